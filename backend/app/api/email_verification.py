@@ -6,7 +6,9 @@ from fastapi import APIRouter, HTTPException, Query
 from fastapi.responses import RedirectResponse
 from pydantic import BaseModel, EmailStr
 from typing import Optional
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
 
 from app.core.email_verification import get_email_verification_system
@@ -103,11 +105,11 @@ async def send_verification_email(request: SendVerificationRequest):
             )
         
         # Enviar email
-        success = email_system.send_verification_email(
+        success = await asyncio.wrap_future(email_system.send_verification_email_async(
             user_id=request.user_id,
             username=request.username,
             email=request.email
-        )
+        ))
         
         if success:
             return SendVerificationResponse(
@@ -146,8 +148,8 @@ async def verify_email_token(token: str = Query(..., description="Token de verif
         # Verificar token
         result = email_system.verify_token(token)
         
-        # URL del frontend
-        frontend_url = os.getenv('FRONTEND_URL', 'http://localhost:3000')
+        # URL del frontend (leída una sola vez al crear el sistema)
+        frontend_url = email_system.frontend_url
         
         if result.success:
             # Redirigir al frontend con éxito
@@ -180,41 +182,33 @@ async def resend_verification_code(request: dict):
         dict: resultado del reenvío del código de verificación
     """
     try:
-        from datetime import datetime
-        
         user_id = request.get('user_id')
         username = request.get('username')
         email = request.get('email')
         
         email_system = get_email_verification_system()
         
-        # Verificar si puede reenviar (cooldown de 60 segundos)
+        # Verificar si puede reenviar (cooldown configurado en el sistema)
         verification = email_system._load_verification(user_id)
         
         if verification:
-            # Verificar cooldown
-            created_at = datetime.fromisoformat(verification.created_at)
-            
-            # CORRECCIÓN: Remover timezone si existe para evitar error
-            if created_at.tzinfo is not None:
-                created_at = created_at.replace(tzinfo=None)
-            
-            # Calcular tiempo transcurrido con datetime naive
-            elapsed = (datetime.now() - created_at).total_seconds()
+            # Verificar cooldown (created_at ya convertido a timestamp POSIX)
+            elapsed = time.time() - verification.created_at_ts
             
-            if elapsed < 60:  # Cooldown de 60 segundos
-                remaining = int(60 - elapsed)
+            cooldown = email_system.resend_cooldown_seconds
+            if elapsed < cooldown:
+                remaining = int(cooldown - elapsed)
                 return {
                     "success": False,
                     "message": f"Espera {remaining} segundos antes de reenviar"
                 }
         
         # Enviar nuevo código
-        success = email_system.send_verification_email(
+        success = await asyncio.wrap_future(email_system.send_verification_email_async(
             user_id=user_id,
             username=username,
             email=email
-        )
+        ))
         
         if not success:
             return {
@@ -276,11 +270,11 @@ async def resend_verification_email(request: ResendVerificationRequest):
             )
         
         # Reenviar email (genera nuevo token)
-        success = email_system.send_verification_email(
+        success = await asyncio.wrap_future(email_system.send_verification_email_async(
             user_id=request.user_id,
             username="Usuario",  # Se podría pasar en el request si se necesita
             email=verification.email
-        )
+        ))
         
         if success:
             return ResendVerificationResponse(
@@ -383,18 +377,14 @@ async def verify_code(request: dict):
             }
                 
         # Expirado
-        expires_at = datetime.fromisoformat(verification.expires_at)
-        # Remover timezone si existe para comparación
-        if expires_at.tzinfo is not None:
-            expires_at = expires_at.replace(tzinfo=None)
-        if datetime.now() > expires_at:
+        if time.time() > verification.expires_at_ts:
             return {
                 "success": False,
                 "message": "Código expirado. Solicita uno nuevo."
             }
         
         # Verificar código
-        if verification.token != code:
+        if not email_system.token_matches(verification, code):
             return {
                 "success": False,
                 "message": "Código incorrecto."
@@ -403,7 +393,14 @@ async def verify_code(request: dict):
         # Marcar como verificado
         verification.verified = True
         verification.verification_date = datetime.now().isoformat()
-        email_system._save_verification(verification)
+        
+        # Compare-and-set: si otra petición consumió el código antes, no se
+        # da por bueno un segundo uso
+        if not email_system._save_verification(verification):
+            return {
+                "success": False,
+                "message": "Este código ya fue utilizado."
+            }
         
         print(f"Código verificado: {verification.email}")
         
@@ -431,14 +428,16 @@ async def cleanup_expired_verifications():
         dict:
             - success (bool): indica si la limpieza se ejecutó correctamente
             - message (str): resultado de la operación
+            - deleted (int): número de tokens eliminados
     """
     try:
         email_system = get_email_verification_system()
-        email_system.cleanup_expired_verifications()
+        deleted = email_system.cleanup_expired_verifications()
         
         return {
             "success": True,
-            "message": "Tokens expirados limpiados exitosamente"
+            "message": "Tokens expirados limpiados exitosamente",
+            "deleted": deleted
         }
     
     except Exception as e:
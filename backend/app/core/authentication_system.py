@@ -2865,7 +2865,7 @@ class RealAuthenticationSystem:
                         if bootstrap_mode:
                             # SUB-MÉTODO 3A: Bootstrap Anatómico (bootstrap_features)
                             bootstrap_features = metadata.get('bootstrap_features', None)
-                            if bootstrap_features:
+                            if bootstrap_features is not None and len(bootstrap_features) > 0:
                                 print(f"  Template Bootstrap anatómico detectado: {len(bootstrap_features)} características")
                                 
                                 try:
@@ -2917,7 +2917,7 @@ class RealAuthenticationSystem:
                                 temporal_sequence = metadata.get('temporal_sequence', None)
                                 has_temporal_data = metadata.get('has_temporal_data', False)
                                 
-                                if temporal_sequence and has_temporal_data:
+                                if temporal_sequence is not None and len(temporal_sequence) > 0 and has_temporal_data:
                                     print(f"  Template Bootstrap dinámico detectado: secuencia temporal")
                                     
                                     try:
@@ -8,16 +8,22 @@ import json
 import pickle
 import os
 import shutil
+import tarfile
+import gzip
+import io
 import hashlib
 import time
 import uuid
 import logging
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional, Any, Union
+from typing import List, Dict, Tuple, Optional, Any, Union, Iterator
 from dataclasses import dataclass, field, asdict
 from enum import Enum
-from collections import defaultdict
+from collections import defaultdict, Counter
+import queue
 import threading
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 import warnings
 
 # Cryptography imports
@@ -28,6 +34,14 @@ except ImportError:
     CRYPTO_AVAILABLE = False
     logging.warning("Cryptography no disponible")
 
+# Serialización JSON rápida (opcional)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    logging.warning("orjson no disponible - usando json estándar")
+
 from datetime import datetime, timedelta
 
 # Importar módulos anteriores
@@ -47,6 +61,49 @@ except ImportError:
 logger = logging.getLogger(__name__)
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 
+# Escritura diferida de intentos de autenticación
+AUTH_WRITE_BATCH_SIZE = 64
+AUTH_WRITE_BATCH_TIMEOUT = 0.01  # segundos
+_AUTH_WRITER_STOP = None  # marca de parada en la cola del escritor
+
+# Buffer de escritura para backups comprimidos
+BACKUP_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Borrado paralelo de backups antiguos (por debajo del umbral, secuencial)
+BACKUP_CLEANUP_PARALLEL_THRESHOLD = 4
+BACKUP_CLEANUP_WORKERS = 8
+
+# Arrays de metadata Bootstrap guardados como .npy junto al JSON: clave -> sufijo
+METADATA_ARRAY_SIDECARS = {
+    'bootstrap_features': 'anat',
+    'temporal_sequence': 'seq',
+}
+NPY_SENTINEL = '__npy__'
+
+# Tamaño de lote para generar embeddings al convertir templates Bootstrap
+BOOTSTRAP_EMBEDDING_BATCH_SIZE = 256
+
+
+def _json_default(obj):
+    """Serializador JSON para tipos NumPy (resto como string)."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+
+def _dumps(obj, indent: bool = True) -> bytes:
+    """Serializa a JSON (bytes), con orjson si está disponible."""
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_json_default, option=option)
+    if indent:
+        return json.dumps(obj, indent=2, default=_json_default).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), default=_json_default).encode('utf-8')
+
 
 class TemplateType(Enum):
     """Tipos de templates biométricos."""
@@ -268,6 +325,8 @@ class DatabaseStats:
     anatomical_templates: int = 0
     dynamic_templates: int = 0
     multimodal_templates: int = 0
+    anatomical_embeddings: int = 0
+    dynamic_embeddings: int = 0
     
     excellent_quality: int = 0
     good_quality: int = 0
@@ -612,6 +671,41 @@ class BiometricDatabase:
         self.cache = {}
         self.stats = DatabaseStats()
         
+        # Índice user_id -> templates anatómicos Bootstrap con características raw
+        self._user_anatomical_bootstrap: Dict[str, List[str]] = defaultdict(list)
+        
+        # Caché de verificación de integridad: template_id -> (st_mtime_ns, checksum_ok)
+        self._integrity_cache: Dict[str, Tuple[int, bool]] = {}
+        
+        # IDs de templates en modo Bootstrap (dict como conjunto ordenado)
+        self._bootstrap_template_ids: Dict[str, None] = {}
+        
+        # Atributos contados por template: template_id -> (tipo, tiene embedding
+        # anatómico, tiene embedding dinámico). Al descontar se usa esta foto y
+        # no el objeto, que el llamador puede haber modificado in situ
+        self._counted_templates: Dict[str, Tuple[TemplateType, bool, bool]] = {}
+        
+        # Espejo en conjunto de gesture_sequence por usuario: user_id -> (lista, tamaño, set)
+        self._gesture_sets: Dict[str, Tuple[List[str], int, set]] = {}
+        
+        # Buffer reutilizable para construir secuencias temporales de fallback
+        self._frame_scratch = np.zeros((64, 320), dtype=np.float32)
+        
+        # Intentos de autenticación: memoria + escritura diferida en disco
+        self.auth_attempts: Dict[str, List[AuthenticationAttempt]] = {}
+        self._write_queue: queue.Queue = queue.Queue()
+        self._writer_thread = threading.Thread(
+            target=self._writer_loop,
+            name='auth-attempts-writer',
+            daemon=True
+        )
+        self._writer_thread.start()
+        self._writer_closed = False
+        
+        # Al salir del proceso se vacía la cola: el hilo es daemon (no retiene
+        # la salida) pero close() espera a que termine de escribir
+        atexit.register(self.close)
+        
         self._load_database()
         
         print(f"BiometricDatabase inicializada en: {self.db_path}")
@@ -898,6 +992,13 @@ class BiometricDatabase:
                                     checksum=template_data.get('checksum', '')
                                 )
                                 
+                                # Resolver referencias .npy: en memoria siempre hay ndarray,
+                                # igual que tras enroll_template_bootstrap
+                                for key in METADATA_ARRAY_SIDECARS:
+                                    value = template.metadata.get(key)
+                                    if isinstance(value, dict) and NPY_SENTINEL in value:
+                                        template.metadata[key] = self._metadata_array(template, key)
+                                
                                 print(f"   Template Bootstrap cargado: {template.gesture_name}")
                                 
                             else:
@@ -976,6 +1077,8 @@ class BiometricDatabase:
                                 print(f"   Template normal: {template.gesture_name} - Método: {load_method}")
                             
                             self.templates[template.template_id] = template
+                            self._index_bootstrap_template(template)
+                            self._track_bootstrap_template(template)
                             templates_loaded += 1
                             
                             if template.anatomical_embedding is not None:
@@ -1090,25 +1193,15 @@ class BiometricDatabase:
                 self.stats.total_users = users_loaded
                 self.stats.total_templates = templates_loaded
                 
-                anatomical_count = 0
-                dynamic_count = 0
-                multimodal_count = 0
-                bootstrap_count = 0
+                self.stats.anatomical_templates = 0
+                self.stats.dynamic_templates = 0
+                self.stats.multimodal_templates = 0
+                self.stats.anatomical_embeddings = 0
+                self.stats.dynamic_embeddings = 0
                 
+                self._counted_templates.clear()
                 for template in self.templates.values():
-                    if template.metadata.get('bootstrap_mode', False):
-                        bootstrap_count += 1
-                    
-                    if template.template_type == TemplateType.ANATOMICAL:
-                        anatomical_count += 1
-                    elif template.template_type == TemplateType.DYNAMIC:
-                        dynamic_count += 1
-                    elif template.template_type == TemplateType.MULTIMODAL:
-                        multimodal_count += 1
-                
-                self.stats.anatomical_templates = anatomical_count
-                self.stats.dynamic_templates = dynamic_count
-                self.stats.multimodal_templates = multimodal_count
+                    self._adjust_template_counters(template, 1)
                 
                 self._update_stats()
                 
@@ -1122,10 +1215,10 @@ class BiometricDatabase:
             print("=" * 60)
             print(f"USUARIOS: {users_loaded}")
             print(f"TEMPLATES: {templates_loaded}")
-            print(f"   Anatómicos: {anatomical_count}")
-            print(f"   Dinámicos: {dynamic_count}")
-            print(f"   Multimodales: {multimodal_count}")
-            print(f"   Bootstrap: {bootstrap_count}")
+            print(f"   Anatómicos: {self.stats.anatomical_templates}")
+            print(f"   Dinámicos: {self.stats.dynamic_templates}")
+            print(f"   Multimodales: {self.stats.multimodal_templates}")
+            print(f"   Bootstrap: {len(self._bootstrap_template_ids)}")
             print("=" * 60)
             
             if users_loaded > 0:
@@ -1281,7 +1374,8 @@ class BiometricDatabase:
                     logger.error(f"Usuario {template.user_id} no existe para template {template.template_id}")
                     return False
                 
-                if template.template_id in self.templates:
+                previous_template = self.templates.get(template.template_id)
+                if previous_template is not None:
                     print(f"Template {template.template_id} ya existe - actualizando")
                 
                 complete_template = template
@@ -1296,6 +1390,7 @@ class BiometricDatabase:
                     complete_template.checksum = "error_calculating"
                 
                 self.templates[template.template_id] = complete_template
+                self._track_bootstrap_template(complete_template)
                 
                 if hasattr(template, 'anatomical_embedding') and template.anatomical_embedding is not None:
                     try:
@@ -1355,13 +1450,11 @@ class BiometricDatabase:
                     print(traceback.format_exc())
                     return False
                 
-                self.stats.total_templates += 1
-                if template.template_type == TemplateType.ANATOMICAL:
-                    self.stats.anatomical_templates += 1
-                elif template.template_type == TemplateType.DYNAMIC:
-                    self.stats.dynamic_templates += 1
+                if previous_template is not None:
+                    self._adjust_template_counters(previous_template, -1)
                 else:
-                    self.stats.multimodal_templates += 1
+                    self.stats.total_templates += 1
+                self._adjust_template_counters(template, 1)
                 
                 try:
                     self._update_stats()
@@ -1459,6 +1552,7 @@ class BiometricDatabase:
                 template.checksum = self._calculate_template_checksum(template)
                 
                 self.templates[template_id] = template
+                self._track_bootstrap_template(template)
                 
                 if anatomical_embedding is not None:
                     self.anatomical_index.add_embedding(anatomical_embedding, template_id, user_id)
@@ -1484,12 +1578,7 @@ class BiometricDatabase:
                 self.dynamic_index.build_index()
                 
                 self.stats.total_templates += 1
-                if template_type == TemplateType.ANATOMICAL:
-                    self.stats.anatomical_templates += 1
-                elif template_type == TemplateType.DYNAMIC:
-                    self.stats.dynamic_templates += 1
-                else:
-                    self.stats.multimodal_templates += 1
+                self._adjust_template_counters(template, 1)
                 
                 if quality_score >= 0.9:
                     self.stats.excellent_quality += 1
@@ -1989,6 +2078,7 @@ class BiometricDatabase:
                     self.delete_template(template.template_id)
                 
                 del self.users[user_id]
+                self._gesture_sets.pop(user_id, None)
                 
                 user_file = self.db_path / 'users' / f'{user_id}.json'
                 if user_file.exists():
@@ -2020,6 +2110,12 @@ class BiometricDatabase:
                 self.dynamic_index.remove_template(template_id)
                 
                 del self.templates[template_id]
+                self._integrity_cache.pop(template_id, None)
+                self._bootstrap_template_ids.pop(template_id, None)
+                
+                bootstrap_ids = self._user_anatomical_bootstrap.get(user_id)
+                if bootstrap_ids and template_id in bootstrap_ids:
+                    bootstrap_ids.remove(template_id)
                 
                 if user_id in self.users:
                     user_profile = self.users[user_id]
@@ -2042,13 +2138,13 @@ class BiometricDatabase:
                 if embedding_file.exists():
                     embedding_file.unlink()
                 
+                for suffix in METADATA_ARRAY_SIDECARS.values():
+                    sidecar_file = self.db_path / 'templates' / f'{template_id}_{suffix}.npy'
+                    if sidecar_file.exists():
+                        sidecar_file.unlink()
+                
                 self.stats.total_templates -= 1
-                if template.template_type == TemplateType.ANATOMICAL:
-                    self.stats.anatomical_templates -= 1
-                elif template.template_type == TemplateType.DYNAMIC:
-                    self.stats.dynamic_templates -= 1
-                else:
-                    self.stats.multimodal_templates -= 1
+                self._adjust_template_counters(template, -1)
                 
                 self._update_stats()
                 
@@ -2064,6 +2160,9 @@ class BiometricDatabase:
         """
         Almacena un intento de autenticación.
         
+        El intento se registra en memoria y la escritura en disco se delega
+        al hilo escritor (_writer_loop), que agrupa varios intentos por lote.
+        
         Args:
             attempt: Intento de autenticación
             
@@ -2077,38 +2176,87 @@ class BiometricDatabase:
                 
                 self.auth_attempts[attempt.user_id].append(attempt)
                 
-                # Guardar en archivo JSON
-                attempts_file = self.db_path / 'auth_attempts' / f'{attempt.user_id}.json'
-                attempts_file.parent.mkdir(parents=True, exist_ok=True)
-                
-                attempts_data = [
-                    {
-                        'attempt_id': a.attempt_id,
-                        'user_id': a.user_id,
-                        'timestamp': a.timestamp,
-                        'auth_type': a.auth_type,
-                        'result': a.result,
-                        'confidence': a.confidence,
-                        'anatomical_score': a.anatomical_score,
-                        'dynamic_score': a.dynamic_score,
-                        'fused_score': a.fused_score,
-                        'ip_address': a.ip_address,
-                        'device_info': a.device_info,
-                        'failure_reason': a.failure_reason,
-                        'metadata': a.metadata
-                    }
-                    for a in self.auth_attempts[attempt.user_id]
-                ]
-                
-                with open(attempts_file, 'w') as f:
-                    json.dump(attempts_data, f, indent=2)
-                
-                logger.info(f"Intento de autenticación guardado: {attempt.attempt_id}")
-                return True
+                # Bajo el lock: close() no puede colar la marca de parada entre
+                # la comprobación y el put
+                writer_closed = self._writer_closed
+                if not writer_closed:
+                    self._write_queue.put(attempt.user_id)
+            
+            if writer_closed:
+                self._save_auth_attempts(attempt.user_id)
+            
+            logger.info(f"Intento de autenticación encolado: {attempt.attempt_id}")
+            return True
                 
         except Exception as e:
             logger.error(f"Error guardando intento: {e}")
             return False
+    
+    def _writer_loop(self):
+        """Hilo escritor: drena la cola y persiste los intentos agrupados por usuario."""
+        stop = False
+        while not stop:
+            item = self._write_queue.get()
+            if item is _AUTH_WRITER_STOP:
+                self._write_queue.task_done()
+                return
+            user_ids = {item}
+            batch_size = 1
+            
+            # Agrupar lo que llegue en la ventana del lote
+            while batch_size < AUTH_WRITE_BATCH_SIZE:
+                try:
+                    item = self._write_queue.get(timeout=AUTH_WRITE_BATCH_TIMEOUT)
+                except queue.Empty:
+                    break
+                batch_size += 1
+                if item is _AUTH_WRITER_STOP:
+                    stop = True
+                    break
+                user_ids.add(item)
+            
+            for user_id in user_ids:
+                try:
+                    self._save_auth_attempts(user_id)
+                except Exception as e:
+                    logger.error(f"Error guardando intentos de {user_id}: {e}")
+            
+            for _ in range(batch_size):
+                self._write_queue.task_done()
+    
+    def _save_auth_attempts(self, user_id: str):
+        """Escribe en disco todos los intentos en memoria de un usuario."""
+        with self.lock:
+            attempts_data = [asdict(a) for a in self.auth_attempts.get(user_id, [])]
+        
+        attempts_file = self.db_path / 'auth_attempts' / f'{user_id}.json'
+        attempts_file.parent.mkdir(parents=True, exist_ok=True)
+        
+        with open(attempts_file, 'w') as f:
+            json.dump(attempts_data, f, indent=2)
+    
+    def flush_auth_attempts(self):
+        """Bloquea hasta que todos los intentos encolados estén en disco."""
+        if self._writer_thread.is_alive():
+            self._write_queue.join()
+    
+    def close(self):
+        """
+        Vacía la cola de intentos y detiene el hilo escritor.
+        
+        Se registra con atexit; los intentos posteriores se escriben en línea.
+        Al cerrar se retira el registro para que atexit no retenga la instancia.
+        """
+        with self.lock:
+            if self._writer_closed:
+                return
+            self._writer_closed = True
+            self._write_queue.put(_AUTH_WRITER_STOP)
+        atexit.unregister(self.close)
+        
+        # Fuera del lock: el escritor lo necesita para serializar los intentos
+        if self._writer_thread.is_alive():
+            self._writer_thread.join()
 
     def get_user_auth_attempts(self, user_id: str, limit: Optional[int] = None) -> List[AuthenticationAttempt]:
         """
@@ -2180,6 +2328,7 @@ class BiometricDatabase:
             print(f"DEBUG: Directorio templates: {templates_dir}")
             
             template_file = templates_dir / f'{template.template_id}.json'
+            self._integrity_cache.pop(template.template_id, None)
             
             # DETECTAR SI ES BOOTSTRAP
             is_bootstrap = template.metadata.get('bootstrap_mode', False)
@@ -2202,7 +2351,7 @@ class BiometricDatabase:
                 'success_count': getattr(template, 'success_count', 0),
                 'is_encrypted': self.config.get('encryption_enabled', False),
                 'checksum': getattr(template, 'checksum', ''),
-                'metadata': getattr(template, 'metadata', {}),
+                'metadata': self._externalize_metadata_arrays(template),
                 
                 # # AGREGAR FLAGS DE EMBEDDINGS (PARA VALIDACIÓN)
                 # 'has_anatomical_embedding': template.anatomical_embedding is not None,
@@ -2216,8 +2365,8 @@ class BiometricDatabase:
             }
             
             print(f"DEBUG: Metadatos preparados")
-            print(f"   Has anatomical: {template_data['has_anatomical_embedding']}")
-            print(f"   Has dynamic: {template_data['has_dynamic_embedding']}")
+            print(f"   Has anatomical: {template.anatomical_embedding is not None}")
+            print(f"   Has dynamic: {template.dynamic_embedding is not None}")
             
             with open(template_file, 'w', encoding='utf-8') as f:
                 json.dump(template_data, f, indent=2, default=str)
@@ -2520,44 +2669,39 @@ class BiometricDatabase:
             if has_dyn_json != has_dyn_actual:
                 print(f"      WARNING: Inconsistencia en embedding dinámico")
             
-            # PREPARAR DATOS PARA CREAR TEMPLATE
-            template_data_copy = template_data.copy()
-            template_data_copy['anatomical_embedding'] = anatomical_embedding
-            template_data_copy['dynamic_embedding'] = dynamic_embedding
-            
             # CONVERTIR TEMPLATE_TYPE STRING A ENUM
-            template_type_value = template_data_copy.get('template_type')
+            template_type_value = template_data.get('template_type')
             if isinstance(template_type_value, str):
                 try:
                     if template_type_value == 'anatomical':
-                        template_data_copy['template_type'] = TemplateType.ANATOMICAL
+                        template_data['template_type'] = TemplateType.ANATOMICAL
                     elif template_type_value == 'dynamic':
-                        template_data_copy['template_type'] = TemplateType.DYNAMIC
+                        template_data['template_type'] = TemplateType.DYNAMIC
                     elif template_type_value == 'multimodal':
-                        template_data_copy['template_type'] = TemplateType.MULTIMODAL
+                        template_data['template_type'] = TemplateType.MULTIMODAL
                     else:
                         print(f"   Tipo desconocido '{template_type_value}', usando ANATOMICAL")
-                        template_data_copy['template_type'] = TemplateType.ANATOMICAL
+                        template_data['template_type'] = TemplateType.ANATOMICAL
                 except Exception as enum_error:
                     print(f"   Error convirtiendo enum: {enum_error}")
-                    template_data_copy['template_type'] = TemplateType.ANATOMICAL
+                    template_data['template_type'] = TemplateType.ANATOMICAL
             
             # CREAR BIOMETRIC TEMPLATE
             print(f"   🏗️ Creando BiometricTemplate...")
             
             try:
                 required_fields = {
-                    'user_id': template_data_copy.get('user_id', 'unknown'),
-                    'template_id': template_data_copy.get('template_id', template_id),
-                    'template_type': template_data_copy.get('template_type', TemplateType.ANATOMICAL),
-                    'gesture_name': template_data_copy.get('gesture_name', 'Unknown'),
-                    'quality_score': float(template_data_copy.get('quality_score', 0.0)),
-                    'confidence': float(template_data_copy.get('confidence', 0.0)),
-                    'enrollment_session': template_data_copy.get('enrollment_session', ''),
-                    'created_at': template_data_copy.get('created_at', time.time()),
-                    'updated_at': template_data_copy.get('updated_at', time.time()),
-                    'metadata': template_data_copy.get('metadata', {}),
-                    'checksum': template_data_copy.get('checksum', ''),
+                    'user_id': template_data.get('user_id', 'unknown'),
+                    'template_id': template_data.get('template_id', template_id),
+                    'template_type': template_data.get('template_type', TemplateType.ANATOMICAL),
+                    'gesture_name': template_data.get('gesture_name', 'Unknown'),
+                    'quality_score': float(template_data.get('quality_score', 0.0)),
+                    'confidence': float(template_data.get('confidence', 0.0)),
+                    'enrollment_session': template_data.get('enrollment_session', ''),
+                    'created_at': template_data.get('created_at', time.time()),
+                    'updated_at': template_data.get('updated_at', time.time()),
+                    'metadata': template_data.get('metadata', {}),
+                    'checksum': template_data.get('checksum', ''),
                     'anatomical_embedding': anatomical_embedding,
                     'dynamic_embedding': dynamic_embedding
                 }
@@ -2565,8 +2709,8 @@ class BiometricDatabase:
                 # Campos opcionales
                 optional_fields = ['last_used', 'verification_count', 'success_count', 'is_encrypted', 'hand_side']
                 for field in optional_fields:
-                    if field in template_data_copy:
-                        required_fields[field] = template_data_copy[field]
+                    if field in template_data:
+                        required_fields[field] = template_data[field]
                 
                 template = BiometricTemplate(**required_fields)
                 
@@ -2627,14 +2771,21 @@ class BiometricDatabase:
         try:
             total_size = 0
             for root, dirs, files in os.walk(self.db_path):
-                total_size += sum(os.path.getsize(os.path.join(root, file)) for file in files)
+                for file in files:
+                    try:
+                        total_size += os.path.getsize(os.path.join(root, file))
+                    except FileNotFoundError:
+                        # Temporal de una escritura concurrente ya renombrado
+                        pass
             
-            self.stats.total_size_mb = total_size / 1024 / 1024
-            self.stats.last_updated = time.time()
+            # Instantánea bajo el lock y escritura atómica: llamadas concurrentes
+            # (p. ej. inscripciones fuera del lock) no intercalan el archivo
+            with self.lock:
+                self.stats.total_size_mb = total_size / 1024 / 1024
+                self.stats.last_updated = time.time()
+                stats_data = json.dumps(asdict(self.stats), indent=2).encode('utf-8')
             
-            stats_file = self.db_path / 'database_stats.json'
-            with open(stats_file, 'w') as f:
-                json.dump(asdict(self.stats), f, indent=2)
+            self._write_files([(self.db_path / 'database_stats.json', stats_data)])
                 
         except Exception as e:
             logger.error(f"Error actualizando estadísticas: {e}")
@@ -2643,20 +2794,32 @@ class BiometricDatabase:
         """Crea backup completo de la base de datos."""
         try:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_dir = self.db_path / 'backups' / f'backup_{timestamp}'
-            backup_dir.mkdir(parents=True, exist_ok=True)
-            
-            for source_dir in ['users', 'templates']:
-                source_path = self.db_path / source_dir
-                dest_path = backup_dir / source_dir
-                
-                if source_path.exists():
-                    shutil.copytree(source_path, dest_path)
+            backups_dir = self.db_path / 'backups'
+            backups_dir.mkdir(parents=True, exist_ok=True)
             
-            backup_archive = self.db_path / 'backups' / f'backup_{timestamp}.tar.gz'
-            shutil.make_archive(str(backup_archive).replace('.tar.gz', ''), 'gztar', backup_dir)
+            backup_archive = backups_dir / f'backup_{timestamp}.tar.gz'
             
-            shutil.rmtree(backup_dir)
+            # Empaquetar directamente desde el origen (sin copia intermedia),
+            # con un buffer de escritura grande delante del stream gzip
+            try:
+                with open(backup_archive, 'wb') as raw, \
+                        io.BufferedWriter(raw, buffer_size=BACKUP_BUFFER_SIZE) as buf, \
+                        gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6, mtime=0) as gz, \
+                        tarfile.open(fileobj=gz, mode='w|') as tar:
+                    for source_dir in ['users', 'templates']:
+                        source_path = self.db_path / source_dir
+                        
+                        if not source_path.exists():
+                            continue
+                        
+                        tar.add(str(source_path), arcname=source_dir, recursive=False)
+                        with os.scandir(source_path) as entries:
+                            for entry in entries:
+                                tar.add(entry.path, arcname=f'{source_dir}/{entry.name}')
+            except BaseException:
+                # No dejar un archivo truncado que la rotación contaría como backup
+                backup_archive.unlink(missing_ok=True)
+                raise
             
             self._cleanup_old_backups()
             
@@ -2673,13 +2836,26 @@ class BiometricDatabase:
             backups_dir = self.db_path / 'backups'
             if not backups_dir.exists():
                 return
-                
-            backup_files = list(backups_dir.glob('backup_*.tar.gz'))
             
-            if len(backup_files) > self.config['max_backups']:
-                backup_files.sort(key=lambda x: x.stat().st_mtime)
-                for old_backup in backup_files[:-self.config['max_backups']]:
-                    old_backup.unlink()
+            with os.scandir(backups_dir) as entries:
+                backup_entries = [
+                    entry for entry in entries
+                    if entry.name.startswith('backup_') and entry.name.endswith('.tar.gz')
+                ]
+            
+            max_backups = self.config['max_backups']
+            if len(backup_entries) > max_backups:
+                backup_entries.sort(key=lambda entry: entry.stat().st_mtime)
+                old_backups = backup_entries[:-max_backups]
+                
+                if len(old_backups) < BACKUP_CLEANUP_PARALLEL_THRESHOLD:
+                    for old_backup in old_backups:
+                        os.unlink(old_backup.path)
+                else:
+                    with ThreadPoolExecutor(max_workers=BACKUP_CLEANUP_WORKERS) as executor:
+                        list(executor.map(os.unlink, [entry.path for entry in old_backups]))
+                
+                for old_backup in old_backups:
                     print(f"Backup antiguo eliminado: {old_backup.name}")
                     
         except Exception as e:
@@ -2690,38 +2866,59 @@ class BiometricDatabase:
         self._update_stats()
         return self.stats
     
+    def _scan_json_files(self, directory: Path) -> Dict[str, os.DirEntry]:
+        """Devuelve {stem: DirEntry} de los archivos .json de un directorio."""
+        if not directory.exists():
+            return {}
+        
+        with os.scandir(directory) as entries:
+            return {
+                entry.name[:-5]: entry
+                for entry in entries
+                if entry.name.endswith('.json') and entry.is_file()
+            }
+    
     def verify_integrity(self) -> Dict[str, Any]:
         """Verifica integridad de la base de datos."""
         try:
             issues = []
             
-            for user_id, user_profile in self.users.items():
-                user_file = self.db_path / 'users' / f'{user_id}.json'
-                if not user_file.exists():
+            # Listar cada directorio una sola vez en lugar de un stat() por archivo
+            existing_users = self._scan_json_files(self.db_path / 'users')
+            existing_templates = self._scan_json_files(self.db_path / 'templates')
+            
+            for user_id in self.users:
+                if user_id not in existing_users:
                     issues.append(f"Archivo usuario faltante: {user_id}")
             
             for template_id, template in self.templates.items():
-                template_file = self.db_path / 'templates' / f'{template_id}.json'
-                if not template_file.exists():
+                entry = existing_templates.get(template_id)
+                if entry is None:
                     issues.append(f"Archivo template faltante: {template_id}")
+                    mtime_ns = None
+                else:
+                    mtime_ns = entry.stat().st_mtime_ns
+                
+                # Solo recalcular el checksum si el archivo cambió desde la última verificación
+                cached = self._integrity_cache.get(template_id)
+                if mtime_ns is not None and cached and cached[0] == mtime_ns:
+                    checksum_ok = cached[1]
+                else:
+                    checksum_ok = self._calculate_template_checksum(template) == template.checksum
+                    if mtime_ns is not None:
+                        self._integrity_cache[template_id] = (mtime_ns, checksum_ok)
                 
-                current_checksum = self._calculate_template_checksum(template)
-                if current_checksum != template.checksum:
+                if not checksum_ok:
                     issues.append(f"Checksum inválido en template: {template_id}")
             
             anatomical_count = len(self.anatomical_index.template_ids)
             dynamic_count = len(self.dynamic_index.template_ids)
             
-            anatomical_templates = len([t for t in self.templates.values() 
-                                      if t.anatomical_embedding is not None])
-            dynamic_templates = len([t for t in self.templates.values() 
-                                   if t.dynamic_embedding is not None])
-            
-            if anatomical_count != anatomical_templates:
-                issues.append(f"Índice anatómico inconsistente: {anatomical_count} vs {anatomical_templates}")
+            if anatomical_count != self.stats.anatomical_embeddings:
+                issues.append(f"Índice anatómico inconsistente: {anatomical_count} vs {self.stats.anatomical_embeddings}")
             
-            if dynamic_count != dynamic_templates:
-                issues.append(f"Índice dinámico inconsistente: {dynamic_count} vs {dynamic_templates}")
+            if dynamic_count != self.stats.dynamic_embeddings:
+                issues.append(f"Índice dinámico inconsistente: {dynamic_count} vs {self.stats.dynamic_embeddings}")
             
             return {
                 'integrity_ok': len(issues) == 0,
@@ -2736,36 +2933,67 @@ class BiometricDatabase:
             logger.error(f"Error verificando integridad: {e}")
             return {'integrity_ok': False, 'error': str(e)}
     
+    def _template_export_dict(self, template: BiometricTemplate, include_embeddings: bool) -> Dict[str, Any]:
+        """Construye el diccionario de exportación de un template sin copias profundas."""
+        anatomical_embedding = None
+        dynamic_embedding = None
+        if include_embeddings:
+            anatomical_embedding = template.anatomical_embedding
+            dynamic_embedding = template.dynamic_embedding
+        
+        return {
+            'user_id': template.user_id,
+            'template_id': template.template_id,
+            'template_type': template.template_type.value,
+            'anatomical_embedding': anatomical_embedding,
+            'dynamic_embedding': dynamic_embedding,
+            'gesture_name': template.gesture_name,
+            'hand_side': template.hand_side,
+            'quality_score': template.quality_score,
+            'confidence': template.confidence,
+            'created_at': template.created_at,
+            'updated_at': template.updated_at,
+            'last_used': template.last_used,
+            'enrollment_session': template.enrollment_session,
+            'verification_count': template.verification_count,
+            'success_count': template.success_count,
+            'is_encrypted': template.is_encrypted,
+            'checksum': template.checksum,
+            'metadata': template.metadata,
+        }
+    
     def export_database(self, export_path: str, include_embeddings: bool = True) -> bool:
-        """Exporta la base de datos a un archivo."""
+        """
+        Exporta la base de datos a un archivo NDJSON.
+        
+        La primera línea es una cabecera con versión y estadísticas; después
+        se escribe un registro por usuario ({'user': ..., 'profile': ...}) y
+        uno por template ({'template': ..., 'data': ...}), de modo que nunca
+        se mantiene la exportación completa en memoria.
+        """
         try:
-            export_data = {
-                'users': {},
-                'templates': {},
+            header = {
+                'version': '2.0',
+                'format': 'ndjson',
                 'stats': asdict(self.stats),
                 'export_timestamp': time.time(),
-                'version': '1.0'
+                'users_count': len(self.users),
+                'templates_count': len(self.templates)
             }
             
-            for user_id, user_profile in self.users.items():
-                export_data['users'][user_id] = asdict(user_profile)
-            
-            for template_id, template in self.templates.items():
-                template_data = asdict(template)
+            with open(export_path, 'wb') as f:
+                f.write(_dumps(header, indent=False) + b'\n')
                 
-                if include_embeddings:
-                    if template.anatomical_embedding is not None:
-                        template_data['anatomical_embedding'] = template.anatomical_embedding.tolist()
-                    if template.dynamic_embedding is not None:
-                        template_data['dynamic_embedding'] = template.dynamic_embedding.tolist()
-                else:
-                    template_data['anatomical_embedding'] = None
-                    template_data['dynamic_embedding'] = None
+                for user_id, user_profile in self.users.items():
+                    record = {'user': user_id, 'profile': asdict(user_profile)}
+                    f.write(_dumps(record, indent=False) + b'\n')
                 
-                export_data['templates'][template_id] = template_data
-            
-            with open(export_path, 'w') as f:
-                json.dump(export_data, f, indent=2, default=str)
+                for template_id, template in self.templates.items():
+                    record = {
+                        'template': template_id,
+                        'data': self._template_export_dict(template, include_embeddings)
+                    }
+                    f.write(_dumps(record, indent=False) + b'\n')
             
             print(f"Base de datos exportada a: {export_path}")
             return True
@@ -2774,15 +3002,49 @@ class BiometricDatabase:
             logger.error(f"Error exportando: {e}")
             return False
     
+    def _adjust_template_counters(self, template: BiometricTemplate, delta: int):
+        """
+        Actualiza incrementalmente los contadores por tipo y por embedding.
+        
+        Args:
+            template: Template agregado (delta=1) o eliminado (delta=-1)
+            delta: Incremento a aplicar
+        """
+        if delta > 0:
+            counted = (template.template_type,
+                       template.anatomical_embedding is not None,
+                       template.dynamic_embedding is not None)
+            self._counted_templates[template.template_id] = counted
+        else:
+            # Descontar lo que se contó en su momento, no el estado actual
+            counted = self._counted_templates.pop(template.template_id, None)
+            if counted is None:
+                counted = (template.template_type,
+                           template.anatomical_embedding is not None,
+                           template.dynamic_embedding is not None)
+        
+        template_type, has_anatomical, has_dynamic = counted
+        if template_type == TemplateType.ANATOMICAL:
+            self.stats.anatomical_templates += delta
+        elif template_type == TemplateType.DYNAMIC:
+            self.stats.dynamic_templates += delta
+        else:
+            self.stats.multimodal_templates += delta
+        
+        if has_anatomical:
+            self.stats.anatomical_embeddings += delta
+        if has_dynamic:
+            self.stats.dynamic_embeddings += delta
+    
     def get_summary(self) -> Dict[str, Any]:
         """Obtiene resumen de la base de datos."""
         return {
             'database_path': str(self.db_path),
             'total_users': len(self.users),
             'total_templates': len(self.templates),
-            'anatomical_templates': len([t for t in self.templates.values() if t.anatomical_embedding is not None]),
-            'dynamic_templates': len([t for t in self.templates.values() if t.dynamic_embedding is not None]),
-            'multimodal_templates': len([t for t in self.templates.values() if t.template_type == TemplateType.MULTIMODAL]),
+            'anatomical_templates': self.stats.anatomical_embeddings,
+            'dynamic_templates': self.stats.dynamic_embeddings,
+            'multimodal_templates': self.stats.multimodal_templates,
             'encryption_enabled': self.config['encryption_enabled'],
             'search_strategy': self.config['search_strategy'],
             'database_size_mb': self.stats.total_size_mb,
@@ -2801,8 +3063,15 @@ class BiometricDatabase:
         """Enrolla datos en modo Bootstrap (sin embeddings todavía)."""
         try:
             with self.lock:
-                if user_id not in self.users:
-                    print(f"Usuario {user_id} no existe - Creando automáticamente")
+                # Referencias locales para el camino caliente de inscripción.
+                # Bootstrap no cifra: los templates se guardan sin embeddings
+                # y con is_encrypted=False, así que no se consulta la configuración
+                templates = self.templates
+                users = self.users
+                stats = self.stats
+                
+                if user_id not in users:
+                    logger.debug(f"Usuario {user_id} no existe - Creando automáticamente")
                     
                     username = "Usuario Bootstrap"
                     if sample_metadata and 'session_username' in sample_metadata:
@@ -2818,11 +3087,8 @@ class BiometricDatabase:
                     # VALIDACIÓN DE SEGURIDAD (por si acaso)
                     if not all([email, phone_number, age, gender]):
                         error_msg = f"ERROR CRÍTICO: Usuario {user_id} sin datos completos en metadata"
-                        print(error_msg)
-                        print(f"   Email: {email}")
-                        print(f"   Phone: {phone_number}")
-                        print(f"   Age: {age}")
-                        print(f"   Gender: {gender}")
+                        logger.error(error_msg)
+                        logger.error(f"   Email: {email}, Phone: {phone_number}, Age: {age}, Gender: {gender}")
                         raise ValueError("Datos obligatorios faltantes en enrollment bootstrap")
                     
                     user_profile = UserProfile(
@@ -2840,15 +3106,16 @@ class BiometricDatabase:
                         }
                     )
                     
-                    self.users[user_id] = user_profile
+                    users[user_id] = user_profile
                     self._save_user(user_profile)
                     
-                    print(f"Usuario {user_id} creado automáticamente:")
-                    print(f"   Nombre: {username}")
-                    print(f"   Email: {email}")
-                    print(f"   Teléfono: {phone_number}")
-                    print(f"   Edad: {age}")
-                    print(f"   Género: {gender}")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"Usuario {user_id} creado automáticamente:")
+                        logger.debug(f"   Nombre: {username}")
+                        logger.debug(f"   Email: {email}")
+                        logger.debug(f"   Teléfono: {phone_number}")
+                        logger.debug(f"   Edad: {age}")
+                        logger.debug(f"   Género: {gender}")
                 
                 if anatomical_features is None:
                     logger.error("Se requieren características anatómicas en Bootstrap")
@@ -2876,7 +3143,7 @@ class BiometricDatabase:
                     metadata=(sample_metadata or {}).copy()
                 )
                 
-                anatomical_template.metadata['bootstrap_features'] = anatomical_features.tolist()
+                anatomical_template.metadata['bootstrap_features'] = np.asarray(anatomical_features, dtype=np.float32)
                 anatomical_template.metadata['has_anatomical_raw'] = True
                 anatomical_template.metadata['feature_dimensions'] = len(anatomical_features)
                 anatomical_template.metadata['bootstrap_mode'] = True
@@ -2892,6 +3159,9 @@ class BiometricDatabase:
                 data_source_found = None
                 is_real_temporal = False
                 
+                # Archivos (ruta, bytes) a escribir en lote al final de la inscripción
+                pending_writes: List[Tuple[Path, bytes]] = []
+                
                 try:
                     log_info("BUSCANDO datos temporales REALES desde metadata de muestra...")
                     
@@ -2906,14 +3176,15 @@ class BiometricDatabase:
                         data_source_found = sample_metadata.get('data_source', 'real_enrollment_capture')
                         is_real_temporal = True  # SIEMPRE real si viene de metadata de muestra
                         
-                        print(f"MÉTODO PRINCIPAL: Secuencia temporal REAL encontrada en metadata: {temporal_sequence.shape}")
-                        print(f"   Fuente: {data_source_found}")
-                        print(f"   Longitud: {sample_metadata.get('sequence_length', len(temporal_sequence))} frames")
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug(f"MÉTODO PRINCIPAL: Secuencia temporal REAL encontrada en metadata: {temporal_sequence.shape}")
+                            logger.debug(f"   Fuente: {data_source_found}")
+                            logger.debug(f"   Longitud: {sample_metadata.get('sequence_length', len(temporal_sequence))} frames")
                     
                     # MÉTODO ALTERNATIVO: BUSCAR EN ENROLLMENT SYSTEM ACTIVO (SOLO SI NO HAY DATOS)
                     elif temporal_sequence is None:  
                         try:
-                            print("MÉTODO ALTERNATIVO: Buscando en sesiones activas...")
+                            logger.debug("MÉTODO ALTERNATIVO: Buscando en sesiones activas...")
                             # Buscar directamente en este objeto si es el enrollment system
                             if hasattr(self, 'active_sessions'):
                                 for session_id, session in self.active_sessions.items():
@@ -2930,40 +3201,40 @@ class BiometricDatabase:
                                                 data_source_found = getattr(sample, 'metadata', {}).get('data_source', 'session_sample_real')
                                                 is_real_temporal = True  # SIEMPRE real si viene de muestra de sesión
                                                 
-                                                print(f"MÉTODO ALTERNATIVO: Secuencia temporal REAL desde muestra: {temporal_sequence.shape}")
-                                                print(f"   Sample ID: {sample.sample_id}")
-                                                print(f"   Gesto: {sample.gesture_name}")
+                                                logger.debug(f"MÉTODO ALTERNATIVO: Secuencia temporal REAL desde muestra: {temporal_sequence.shape}")
+                                                logger.debug(f"   Sample ID: {sample.sample_id}")
+                                                logger.debug(f"   Gesto: {sample.gesture_name}")
                                                 break
                                         
                                         if temporal_sequence is not None:
                                             break
                         except Exception as e:
-                            print(f"Método alternativo falló: {e}")
+                            logger.debug(f"Método alternativo falló: {e}")
                     
                     # MÉTODO DE FALLBACK: SOLO SI NO HAY DATOS REALES (ÚLTIMO RECURSO)
-                    elif temporal_sequence is None: 
+                    # (if independiente: se evalúa después del método alternativo)
+                    if temporal_sequence is None:
                         logger.warning("NO se encontraron datos temporales REALES - usando fallback")
                         try:
                             # Usar templates anatómicos previos del mismo usuario
-                            user_anatomical_templates = []
-                            for template_id, template in self.templates.items():
-                                if (template.user_id == user_id and 
-                                    template.template_type == TemplateType.ANATOMICAL and
-                                    'bootstrap_features' in template.metadata):
-                                    user_anatomical_templates.append(template.metadata['bootstrap_features'])
+                            user_anatomical_templates = [
+                                self._metadata_array(templates[tid], 'bootstrap_features')
+                                for tid in self._user_anatomical_bootstrap.get(user_id, ())
+                            ]
                             
                             # Incluir características actuales
-                            user_anatomical_templates.append(anatomical_features.tolist())
+                            user_anatomical_templates.append(anatomical_features)
                             
                             if len(user_anatomical_templates) >= 5:
                                 # Crear secuencia temporal desde características anatómicas
-                                temporal_frames = []
-                                for anat_features in user_anatomical_templates[-20:]:  # Max 20
-                                    padded_features = np.zeros(320)
-                                    padded_features[:min(len(anat_features), 320)] = anat_features[:320]
-                                    temporal_frames.append(padded_features)
-                                
-                                temporal_sequence = np.array(temporal_frames, dtype=np.float32)
+                                source_frames = user_anatomical_templates[-20:]  # Max 20
+                                # Construir sobre el buffer reutilizable (protegido por self.lock)
+                                frames = self._frame_scratch[:len(source_frames)]
+                                frames.fill(0)
+                                for i, anat_features in enumerate(source_frames):
+                                    n = min(len(anat_features), 320)
+                                    frames[i, :n] = anat_features[:n]
+                                temporal_sequence = frames.copy()
                                 data_source_found = 'anatomical_templates_fallback'
                                 is_real_temporal = False 
                                 
@@ -2989,7 +3260,7 @@ class BiometricDatabase:
                             confidence=confidence,
                             enrollment_session=str(uuid.uuid4()),
                             metadata={
-                                'temporal_sequence': temporal_sequence.tolist(),
+                                'temporal_sequence': temporal_sequence,
                                 'sequence_length': len(temporal_sequence),
                                 'has_temporal_data': True,
                                 'bootstrap_mode': True,
@@ -3001,18 +3272,18 @@ class BiometricDatabase:
                             }
                         )
                         
-                        # Calcular checksum y guardar template dinámico
-                        dynamic_template.checksum = self._calculate_template_checksum(dynamic_template)
-                        self.templates[dynamic_template_id] = dynamic_template
+                        templates[dynamic_template_id] = dynamic_template
+                        self._bootstrap_template_ids[dynamic_template_id] = None
                         
-                        # Guardar template dinámico en disco
-                        self._save_template_bootstrap(dynamic_template)
+                        # Serializar template dinámico (se escribe junto al resto al final)
+                        pending_writes.extend(self._serialize_template_bootstrap(dynamic_template))
                         
-                        print(f"Template dinámico bootstrap creado: {dynamic_template_id}")
-                        print(f"   Secuencia temporal: {len(temporal_sequence)} frames x {temporal_sequence.shape[1]} características")
-                        print(f"   Fuente datos: {final_data_source}")
-                        print(f"   Es temporal real: {is_real_temporal}")
-                        print(f"   100% REAL: {'SÍ OK' if is_real_temporal else 'NO (Fallback)'}")
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug(f"Template dinámico bootstrap creado: {dynamic_template_id}")
+                            logger.debug(f"   Secuencia temporal: {len(temporal_sequence)} frames x {temporal_sequence.shape[1]} características")
+                            logger.debug(f"   Fuente datos: {final_data_source}")
+                            logger.debug(f"   Es temporal real: {is_real_temporal}")
+                            logger.debug(f"   100% REAL: {'SÍ OK' if is_real_temporal else 'NO (Fallback)'}")
                         
                         # También guardar referencia en template anatómico para debugging
                         anatomical_template.metadata['paired_dynamic_template'] = dynamic_template_id
@@ -3033,77 +3304,105 @@ class BiometricDatabase:
                 # PASO 3: GUARDAR TEMPLATE ANATÓMICO
                 # =========================================================================
                 
-                anatomical_template.checksum = self._calculate_template_checksum(anatomical_template)
-                self.templates[anatomical_template_id] = anatomical_template
-                self._save_template_bootstrap(anatomical_template)
+                templates[anatomical_template_id] = anatomical_template
+                self._bootstrap_template_ids[anatomical_template_id] = None
+                pending_writes.extend(self._serialize_template_bootstrap(anatomical_template))
                 
                 # =========================================================================
                 # PASO 4: ACTUALIZAR PERFIL DE USUARIO CON AMBOS TEMPLATES
                 # =========================================================================
                 
-                user_profile = self.users[user_id]
+                user_profile = users[user_id]
                 
                 user_profile.anatomical_templates.append(anatomical_template_id)
-                print(f"Template anatómico: {anatomical_template_id}")
+                logger.debug(f"Template anatómico: {anatomical_template_id}")
                 
                 if dynamic_template_id:
                     user_profile.dynamic_templates.append(dynamic_template_id)
-                    print(f"Template dinámico: {dynamic_template_id}")
+                    logger.debug(f"Template dinámico: {dynamic_template_id}")
                 
                 templates_created = 2 if dynamic_template_id else 1
                 user_profile.total_enrollments += templates_created
                 user_profile.updated_at = time.time()
                 user_profile.metadata['bootstrap_templates'] = user_profile.metadata.get('bootstrap_templates', 0) + templates_created
                 
-                if gesture_name not in user_profile.gesture_sequence:
+                gesture_set = self._user_gesture_set(user_profile)
+                gesture_added = gesture_name not in gesture_set
+                if gesture_added:
                     user_profile.gesture_sequence.append(gesture_name)
-                    print(f"Agregado gesto '{gesture_name}' a secuencia del usuario {user_id}")
+                    gesture_set.add(gesture_name)
+                    self._gesture_sets[user_id] = (user_profile.gesture_sequence, len(user_profile.gesture_sequence), gesture_set)
+                    logger.debug(f"Agregado gesto '{gesture_name}' a secuencia del usuario {user_id}")
                 
-                self._save_user(user_profile)
+                self._index_bootstrap_template(anatomical_template)
                 
                 # =========================================================================
                 # PASO 5: ACTUALIZAR ESTADÍSTICAS
                 # =========================================================================
                 
-                self.stats.total_templates += templates_created
-                self.stats.anatomical_templates += 1
+                stats.total_templates += templates_created
+                self._adjust_template_counters(anatomical_template, 1)
                 if dynamic_template_id:
-                    self.stats.dynamic_templates += 1
+                    self._adjust_template_counters(templates[dynamic_template_id], 1)
                 
                 if quality_score >= 0.9:
-                    self.stats.excellent_quality += templates_created
+                    stats.excellent_quality += templates_created
                 elif quality_score >= 0.7:
-                    self.stats.good_quality += templates_created
+                    stats.good_quality += templates_created
                 elif quality_score >= 0.5:
-                    self.stats.fair_quality += templates_created
+                    stats.fair_quality += templates_created
                 else:
-                    self.stats.poor_quality += templates_created
-                
-                self._update_stats()
-                
-                print(f"BOOTSTRAP COMPLETO:")
-                print(f"   Templates creados: {templates_created}")
-                print(f"   Anatómico: {anatomical_template_id}")
+                    stats.poor_quality += templates_created
+                
+            # Fuera del lock: el estado en memoria ya es consistente y los payloads
+            # se serializaron dentro de la sección crítica. Templates y .npy
+            # (ids nuevos, sin otros escritores) en un solo lote con un único
+            # fsync del directorio. Un error de escritura deshace la inscripción
+            # en memoria y hace fallar el enrollment
+            created_ids = [anatomical_template_id] + ([dynamic_template_id] if dynamic_template_id else [])
+            try:
+                self._write_files(pending_writes)
+                self._fsync_directory(self.db_path / 'templates')
+                
+                # El perfil sí lo escriben otras inscripciones concurrentes: se
+                # serializa y escribe bajo el lock desde el estado actual en memoria,
+                # así una instantánea antigua nunca reemplaza a una más reciente
+                with self.lock:
+                    self._write_files([self._serialize_user(users[user_id])])
+            except Exception:
+                self._rollback_bootstrap_enrollment(
+                    user_id, created_ids, quality_score,
+                    gesture_name if gesture_added else None
+                )
+                raise
+            self._fsync_directory(self.db_path / 'users')
+            
+            self._update_stats()
+            
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"BOOTSTRAP COMPLETO:")
+                logger.debug(f"   Templates creados: {templates_created}")
+                logger.debug(f"   Anatómico: {anatomical_template_id}")
                 if dynamic_template_id:
-                    print(f"   Dinámico: {dynamic_template_id}")
-                
-                     # VERIFICACIÓN FINAL ROBUSTA
-                    dynamic_template = self.templates.get(dynamic_template_id)
+                    logger.debug(f"   Dinámico: {dynamic_template_id}")
+            
+                    # VERIFICACIÓN FINAL ROBUSTA
+                    dynamic_template = templates.get(dynamic_template_id)
                     if dynamic_template and 'is_real_temporal' in dynamic_template.metadata:
                         is_real_final = dynamic_template.metadata['is_real_temporal']
                         data_source_final = dynamic_template.metadata.get('data_source', 'unknown')
-                        
-                        print(f"   Fuente de datos: {data_source_final}")
-                        print(f"   Datos temporales: {'100% REALES ' if is_real_final else 'Fallback desde anatómicos (SINTÉTICOS)'}")
-                        print(f"   Verificación final: is_real_temporal = {is_real_final}")
+                    
+                        logger.debug(f"   Fuente de datos: {data_source_final}")
+                        logger.debug(f"   Datos temporales: {'100% REALES ' if is_real_final else 'Fallback desde anatómicos (SINTÉTICOS)'}")
+                        logger.debug(f"   Verificación final: is_real_temporal = {is_real_final}")
                     else:
                         logger.warning(f"   No se pudo verificar estado de datos temporales en template dinámico")
                 else:
-                    print(f"   Sin template dinámico (no se encontraron datos temporales)")
-                
-                print(f"   Gesto: {gesture_name}")
-                print(f"   Total enrollments: {user_profile.total_enrollments}")
-                return anatomical_template_id
+                    logger.debug(f"   Sin template dinámico (no se encontraron datos temporales)")
+            
+                logger.debug(f"   Gesto: {gesture_name}")
+                logger.debug(f"   Total enrollments: {user_profile.total_enrollments}")
+            return anatomical_template_id
                 
         except Exception as e:
             logger.error(f"Error Bootstrap: {e}")
@@ -3111,53 +3410,286 @@ class BiometricDatabase:
             logger.error(f"Traceback: {traceback.format_exc()}")
             return None
     
+    def _rollback_bootstrap_enrollment(self, user_id: str, template_ids: List[str],
+                                       quality_score: float, added_gesture: Optional[str]):
+        """
+        Deshace en memoria (y en disco, si llegó a escribirse) una inscripción Bootstrap.
+        
+        Args:
+            user_id: Usuario inscrito
+            template_ids: Templates creados por la inscripción
+            quality_score: Calidad usada para los contadores de calidad
+            added_gesture: Gesto añadido a la secuencia en esta inscripción, si lo hubo
+        """
+        with self.lock:
+            user_profile = self.users.get(user_id)
+            templates_removed = 0
+            
+            for template_id in template_ids:
+                template = self.templates.pop(template_id, None)
+                if template is None:
+                    continue
+                templates_removed += 1
+                self._adjust_template_counters(template, -1)
+                self._bootstrap_template_ids.pop(template_id, None)
+                self._integrity_cache.pop(template_id, None)
+                
+                user_templates = self._user_anatomical_bootstrap.get(user_id)
+                if user_templates and template_id in user_templates:
+                    user_templates.remove(template_id)
+                
+                if user_profile is not None:
+                    for id_list in (user_profile.anatomical_templates, user_profile.dynamic_templates):
+                        if template_id in id_list:
+                            id_list.remove(template_id)
+                
+                # Archivos que sí llegaron a escribirse
+                template_paths = [self.db_path / 'templates' / f'{template_id}.json']
+                template_paths.extend(
+                    self.db_path / 'templates' / f'{template_id}_{suffix}.npy'
+                    for suffix in METADATA_ARRAY_SIDECARS.values()
+                )
+                for path in template_paths:
+                    try:
+                        path.unlink()
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        logger.warning(f"No se pudo eliminar {path}: {e}")
+            
+            self.stats.total_templates -= templates_removed
+            if quality_score >= 0.9:
+                self.stats.excellent_quality -= templates_removed
+            elif quality_score >= 0.7:
+                self.stats.good_quality -= templates_removed
+            elif quality_score >= 0.5:
+                self.stats.fair_quality -= templates_removed
+            else:
+                self.stats.poor_quality -= templates_removed
+            
+            if user_profile is not None:
+                user_profile.total_enrollments -= templates_removed
+                user_profile.metadata['bootstrap_templates'] = max(
+                    0, user_profile.metadata.get('bootstrap_templates', 0) - templates_removed
+                )
+                if added_gesture is not None and added_gesture in user_profile.gesture_sequence:
+                    user_profile.gesture_sequence.remove(added_gesture)
+                    self._gesture_sets.pop(user_id, None)
+    
+    def _user_gesture_set(self, user_profile: UserProfile) -> set:
+        """
+        Obtiene el conjunto espejo de gesture_sequence para pertenencia O(1).
+        
+        La lista sigue siendo la fuente de verdad (orden y formato JSON); el
+        espejo se reconstruye si la lista fue reemplazada o cambió de tamaño.
+        """
+        if user_profile.gesture_sequence is None:
+            user_profile.gesture_sequence = []
+        sequence = user_profile.gesture_sequence
+        
+        cached = self._gesture_sets.get(user_profile.user_id)
+        if cached is None or cached[0] is not sequence or cached[1] != len(sequence):
+            cached = (sequence, len(sequence), set(sequence))
+            self._gesture_sets[user_profile.user_id] = cached
+        
+        return cached[2]
+    
     def _save_template_bootstrap(self, template: BiometricTemplate):
         """Guarda template Bootstrap en disco."""
         try:
-            template_file = self.db_path / 'templates' / f'{template.template_id}.json'
+            logger.debug("Guardando Bootstrap %s", template.template_id)
+            
+            self._write_files(self._serialize_template_bootstrap(template))
+            self._index_bootstrap_template(template)
             
-            print(f"DEBUG: Guardando Bootstrap {template.template_id}")
-            print(f"DEBUG: Ruta archivo: {template_file}")
-            print(f"DEBUG: Directorio existe: {template_file.parent.exists()}")
+            logger.debug("Bootstrap guardado: %s", template.template_id)
+                
+        except Exception as e:
+            logger.error(f"Error guardando Bootstrap: {e}", exc_info=logger.isEnabledFor(logging.DEBUG))
+    
+    def _serialize_template_bootstrap(self, template: BiometricTemplate) -> List[Tuple[Path, bytes]]:
+        """
+        Serializa un template Bootstrap sin tocar disco.
+        
+        Returns:
+            Lista (ruta, bytes) con los .npy de metadata y el JSON del template
+        """
+        template_file = self.db_path / 'templates' / f'{template.template_id}.json'
+        self._integrity_cache.pop(template.template_id, None)
+        
+        # El checksum se calcula una sola vez, en el mismo paso que la serialización
+        template.checksum = self._calculate_template_checksum(template)
+        
+        writes: List[Tuple[Path, bytes]] = []
+        
+        # Diccionario construido campo a campo: sin la copia profunda de asdict
+        # ni conversión de embeddings (no se guardan en modo Bootstrap)
+        template_data = self._template_export_dict(template, include_embeddings=False)
+        template_data['metadata'] = self._externalize_metadata_arrays(template, writes)
+        
+        writes.append((template_file, _dumps(template_data)))
+        return writes
+    
+    def _serialize_user(self, user_profile: UserProfile) -> Tuple[Path, bytes]:
+        """Serializa un perfil de usuario sin tocar disco."""
+        user_file = self.db_path / 'users' / f'{user_profile.user_id}.json'
+        return user_file, json.dumps(asdict(user_profile), indent=2).encode('utf-8')
+    
+    def _write_files(self, writes: List[Tuple[Path, bytes]]):
+        """
+        Escribe un lote de archivos ya serializados.
+        
+        Cada archivo se escribe en un temporal único (escritores concurrentes
+        del mismo archivo no comparten temporal), se sincroniza con fsync y se
+        reemplaza con os.replace, usando descriptores crudos para evitar las
+        capas de buffering de open(). Si algo falla el temporal se elimina.
+        """
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+        
+        for path, data in writes:
+            tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            fd = os.open(tmp_path, flags, 0o644)
+            try:
+                try:
+                    view = memoryview(data)
+                    while view:
+                        written = os.write(fd, view)
+                        view = view[written:]
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                os.replace(tmp_path, path)
+            except BaseException:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                raise
+    
+    def _fsync_directory(self, directory: Path):
+        """Hace durables las entradas de directorio (renames) pendientes."""
+        try:
+            fd = os.open(str(directory), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logger.warning(f"No se pudo sincronizar directorio {directory}: {e}")
+    
+    def _externalize_metadata_arrays(self, template: BiometricTemplate,
+                                     pending_writes: Optional[List[Tuple[Path, bytes]]] = None) -> Dict[str, Any]:
+        """
+        Guarda los arrays grandes de metadata en archivos .npy junto al template.
+        
+        Args:
+            template: Template cuya metadata se va a persistir
+            pending_writes: Si se indica, los .npy se añaden a esta lista
+                (ruta, bytes) en lugar de escribirse inmediatamente
             
-            template_data = asdict(template)
-            template_data['anatomical_embedding'] = None
-            template_data['dynamic_embedding'] = None
+        Returns:
+            Copia superficial de metadata con los arrays reemplazados por
+            {'__npy__': nombre_archivo}
+        """
+        metadata = dict(template.metadata)
+        
+        for key, suffix in METADATA_ARRAY_SIDECARS.items():
+            value = metadata.get(key)
+            if not isinstance(value, (list, np.ndarray)):
+                continue
             
-            print(f"DEBUG: Datos convertidos, gesto: {template_data.get('gesture_name', 'N/A')}")
+            sidecar_name = f'{template.template_id}_{suffix}.npy'
+            sidecar_path = self.db_path / 'templates' / sidecar_name
+            array = np.asarray(value, dtype=np.float32)
             
-            with open(template_file, 'w', encoding='utf-8') as f:
-                json.dump(template_data, f, indent=2, default=str)
+            if pending_writes is None:
+                np.save(sidecar_path, array)
+            else:
+                buffer = io.BytesIO()
+                np.save(buffer, array)
+                pending_writes.append((sidecar_path, buffer.getvalue()))
             
-            print(f"DEBUG: Bootstrap guardado en {template_file}")
-                
-        except Exception as e:
-            print(f"DEBUG ERROR: {e}")
-            import traceback
-            traceback.print_exc()
-            logger.error(f"Error guardando Bootstrap: {e}")
+            metadata[key] = {NPY_SENTINEL: sidecar_name}
+        
+        return metadata
+    
+    def _metadata_array(self, template: BiometricTemplate, key: str) -> Optional[np.ndarray]:
+        """Obtiene un array de metadata, resolviendo referencias a archivos .npy."""
+        value = template.metadata.get(key)
+        
+        if value is None:
+            return None
+        if isinstance(value, dict) and NPY_SENTINEL in value:
+            # Carga completa, sin mmap: son vectores pequeños y un mapeo por
+            # array mantendría un descriptor abierto por sidecar (EMFILE con
+            # cientos de templates) y devolvería arrays de solo lectura
+            return np.load(self.db_path / 'templates' / value[NPY_SENTINEL])
+        return np.asarray(value, dtype=np.float32)
+    
+    def _index_bootstrap_template(self, template: BiometricTemplate):
+        """Registra un template anatómico Bootstrap en el índice por usuario."""
+        if (template.template_type == TemplateType.ANATOMICAL and
+                'bootstrap_features' in template.metadata):
+            user_templates = self._user_anatomical_bootstrap[template.user_id]
+            if template.template_id not in user_templates:
+                user_templates.append(template.template_id)
     
     def convert_bootstrap_to_full_templates(self, siamese_anatomical_network, siamese_dynamic_network=None):
         """Convierte templates Bootstrap a templates completos con embeddings."""
         try:
             with self.lock:
-                bootstrap_templates = []
-                
-                for template_id, template in self.templates.items():
-                    if template.metadata.get('bootstrap_mode', False):
-                        bootstrap_templates.append(template)
+                bootstrap_templates = list(self._iter_bootstrap_templates())
                 
                 print(f"Convirtiendo {len(bootstrap_templates)} templates Bootstrap")
                 
-                converted_count = 0
+                # Reunir características anatómicas para inferencia por lotes
+                batch_templates = []
+                batch_features = []
                 for template in bootstrap_templates:
                     try:
-                        anatomical_features = np.array(template.metadata['bootstrap_features'])
-                        
-                        anatomical_embedding = siamese_anatomical_network.generate_embedding(
-                            anatomical_features.reshape(1, -1)
-                        )[0]
+                        # Aplanado igual que el reshape(1, -1) de la conversión individual
+                        batch_features.append(self._metadata_array(template, 'bootstrap_features').reshape(-1))
+                        batch_templates.append(template)
+                    except Exception as e:
+                        logger.error(f"Error convirtiendo {template.template_id}: {e}")
+                
+                anatomical_embeddings = {}
+                for start in range(0, len(batch_templates), BOOTSTRAP_EMBEDDING_BATCH_SIZE):
+                    chunk = batch_templates[start:start + BOOTSTRAP_EMBEDDING_BATCH_SIZE]
+                    chunk_features = batch_features[start:start + BOOTSTRAP_EMBEDDING_BATCH_SIZE]
+                    
+                    # Agrupar por longitud antes de apilar: un vector de tamaño
+                    # incorrecto no hace fallar al resto del lote
+                    by_length: Dict[int, List[int]] = defaultdict(list)
+                    for i, features in enumerate(chunk_features):
+                        by_length[features.shape[0]].append(i)
+                    
+                    for indices in by_length.values():
+                        try:
+                            features = np.stack([chunk_features[i] for i in indices])
+                            embeddings = siamese_anatomical_network.generate_embedding(features)
+                            for i, embedding in zip(indices, embeddings):
+                                anatomical_embeddings[chunk[i].template_id] = embedding
+                            continue
+                        except Exception as e:
+                            logger.error(f"Error generando embeddings del lote {start}-{start + len(chunk)}: {e}")
                         
+                        # El lote falló: cada template por separado, como antes
+                        for i in indices:
+                            try:
+                                anatomical_embeddings[chunk[i].template_id] = siamese_anatomical_network.generate_embedding(
+                                    chunk_features[i].reshape(1, -1)
+                                )[0]
+                            except Exception as e:
+                                logger.error(f"Error convirtiendo {chunk[i].template_id}: {e}")
+                
+                converted_count = 0
+                for template in batch_templates:
+                    anatomical_embedding = anatomical_embeddings.get(template.template_id)
+                    if anatomical_embedding is None:
+                        continue
+                    
+                    try:
                         dynamic_embedding = None
                         if siamese_dynamic_network and 'dynamic_features' in template.metadata:
                             dynamic_features = np.array(template.metadata['dynamic_features'])
@@ -3165,11 +3697,14 @@ class BiometricDatabase:
                                 dynamic_features.reshape(1, -1)
                             )[0]
                         
+                        self._adjust_template_counters(template, -1)
                         template.anatomical_embedding = anatomical_embedding
                         template.dynamic_embedding = dynamic_embedding
                         template.template_type = TemplateType.MULTIMODAL if dynamic_embedding is not None else TemplateType.ANATOMICAL
+                        self._adjust_template_counters(template, 1)
                         
                         template.metadata['bootstrap_mode'] = False
+                        self._bootstrap_template_ids.pop(template.template_id, None)
                         template.metadata['pending_embedding'] = False
                         template.metadata['converted_at'] = time.time()
                         
@@ -3198,42 +3733,51 @@ class BiometricDatabase:
             logger.error(f"Error convirtiendo Bootstrap: {e}")
             return 0
     
+    def _track_bootstrap_template(self, template: BiometricTemplate):
+        """Registra o descarta el template en el conjunto de IDs Bootstrap."""
+        if template.metadata.get('bootstrap_mode', False):
+            self._bootstrap_template_ids[template.template_id] = None
+        else:
+            self._bootstrap_template_ids.pop(template.template_id, None)
+    
+    def _iter_bootstrap_templates(self, user_id: Optional[str] = None) -> Iterator[BiometricTemplate]:
+        """Itera los templates en modo Bootstrap sin construir una lista intermedia."""
+        for template_id in list(self._bootstrap_template_ids):
+            template = self.templates.get(template_id)
+            if template is not None and (user_id is None or template.user_id == user_id):
+                yield template
+    
     def get_bootstrap_templates(self, user_id: Optional[str] = None) -> List[BiometricTemplate]:
         """Obtiene templates en modo Bootstrap."""
-        bootstrap_templates = []
-        
-        for template in self.templates.values():
-            if template.metadata.get('bootstrap_mode', False):
-                if user_id is None or template.user_id == user_id:
-                    bootstrap_templates.append(template)
-        
-        return bootstrap_templates
+        return list(self._iter_bootstrap_templates(user_id))
     
     def get_bootstrap_stats(self) -> Dict[str, Any]:
         """Obtiene estadísticas de templates Bootstrap."""
-        bootstrap_templates = self.get_bootstrap_templates()
-        
-        user_counts = {}
-        gesture_counts = {}
+        user_ids = []
+        gestures = []
         quality_scores = []
         
-        for template in bootstrap_templates:
-            user_counts[template.user_id] = user_counts.get(template.user_id, 0) + 1
-            
-            gesture = template.gesture_name
-            gesture_counts[gesture] = gesture_counts.get(gesture, 0) + 1
-            
+        # Una sola pasada sobre los templates; el conteo lo hace Counter en C
+        for template in self._iter_bootstrap_templates():
+            user_ids.append(template.user_id)
+            gestures.append(template.gesture_name)
             quality_scores.append(template.quality_score)
         
+        n = len(user_ids)
+        quality_scores = np.asarray(quality_scores, dtype=np.float64)
+        user_counts = Counter(user_ids)
+        gesture_counts = Counter(gestures)
+        has_scores = n > 0
+        
         return {
-            'total_bootstrap_templates': len(bootstrap_templates),
+            'total_bootstrap_templates': n,
             'users_with_bootstrap': len(user_counts),
-            'user_distribution': user_counts,
-            'gesture_distribution': gesture_counts,
-            'average_quality': np.mean(quality_scores) if quality_scores else 0,
-            'min_quality': np.min(quality_scores) if quality_scores else 0,
-            'max_quality': np.max(quality_scores) if quality_scores else 0,
-            'ready_for_training': len(bootstrap_templates) >= 15
+            'user_distribution': dict(user_counts),
+            'gesture_distribution': dict(gesture_counts),
+            'average_quality': float(quality_scores.mean()) if has_scores else 0,
+            'min_quality': float(quality_scores.min()) if has_scores else 0,
+            'max_quality': float(quality_scores.max()) if has_scores else 0,
+            'ready_for_training': n >= 15
         }
 
 
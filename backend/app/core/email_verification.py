@@ -476,22 +476,218 @@ Sistema para enviar y verificar emails usando SendGrid + Supabase PostgreSQL
 """
 
 import os
-import json
+import time
+import html
+import logging
+import hmac
 import secrets
 import hashlib
+import heapq
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
-from dataclasses import dataclass, asdict
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Email, To, Content
+from typing import Optional, Dict, Any, Tuple, List, Callable, TYPE_CHECKING
+from dataclasses import dataclass, field, fields, replace
+from functools import cached_property, lru_cache
+from pathlib import Path
+from string import Formatter
 from dotenv import load_dotenv
 
 # IMPORTAR CLIENTE SUPABASE
 from app.core.supabase_client import get_supabase_client
 
+# sendgrid arrastra python_http_client al importarse: se importa al construir
+# el primer mensaje, no al cargar el módulo
+if TYPE_CHECKING:
+    from sendgrid.helpers.mail import Mail
+
+logger = logging.getLogger(__name__)
+
+# Cliente HTTP con pool de conexiones (dependencia de supabase)
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+    logger.warning("httpx no disponible - usando cliente SendGrid sin keep-alive")
+
+# HTTP/2 (multiplexa envíos concurrentes sobre una conexión) requiere h2
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Serialización JSON rápida del payload de SendGrid (opcional)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    import json
+    ORJSON_AVAILABLE = False
+
 # Cargar variables de entorno
 load_dotenv()
 
+
+class _RateLimitFilter(logging.Filter):
+    """
+    Limita los avisos y errores repetidos del módulo
+    
+    Deja pasar como máximo un registro por mensaje ya formateado y nivel cada
+    `interval` segundos (WARNING o superior): durante una caída de SendGrid o
+    Supabase no se escribe una línea por cada petición fallida, pero errores
+    distintos con la misma plantilla (otro usuario, otra causa) sí se registran.
+    """
+    
+    # Máximo de mensajes recordados (los más antiguos se descartan)
+    MAX_KEYS = 1024
+    
+    def __init__(self, interval: float):
+        super().__init__()
+        self.interval = interval
+        self._last: 'OrderedDict[Tuple[str, int], float]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+        
+        # Clave: el mensaje formateado. El diccionario se poda por antigüedad
+        # y por tamaño, así que el número de claves sigue acotado
+        key = (record.getMessage(), record.levelno)
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and now - last < self.interval:
+                return False
+            self._last[key] = now
+            self._last.move_to_end(key)
+            
+            while self._last:
+                oldest = next(iter(self._last.values()))
+                if now - oldest < self.interval and len(self._last) <= self.MAX_KEYS:
+                    break
+                self._last.popitem(last=False)
+        return True
+
+
+logger.addFilter(_RateLimitFilter(float(os.getenv('EMAIL_LOG_RATE_LIMIT_SECONDS', '5'))))
+
+SENDGRID_API_HOST = 'https://api.sendgrid.com'
+
+# Máximo de destinatarios (personalizations) por llamada a /v3/mail/send
+SENDGRID_MAX_PERSONALIZATIONS = 1000
+
+# Filas borradas por sentencia en la limpieza de expirados (bloqueos cortos)
+CLEANUP_BATCH_SIZE = 1000
+
+# Tope de lotes por limpieza (como mucho CLEANUP_BATCH_SIZE * este valor filas)
+CLEANUP_MAX_BATCHES = 100
+
+# Máximo de tokens en el índice en proceso; se descartan los más antiguos
+# (una ráfaga de registros no puede hacer crecer la memoria sin límite)
+MAX_INDEXED_TOKENS = 50_000
+
+# Máximo de usuarios con caducidad pendiente en el montículo de expiración;
+# el montículo se compacta al superar el doble (entradas obsoletas incluidas)
+MAX_EXPIRY_ENTRIES = 50_000
+
+# Longitud del hash (SHA-256 hex) que se guarda en la columna token
+TOKEN_HASH_LENGTH = 64
+
+# Clave secreta del hash de códigos: con solo 10^6 códigos posibles, un hash
+# sin clave se invierte por fuerza bruta si se filtra la tabla
+_TOKEN_PEPPER = os.getenv('EMAIL_TOKEN_PEPPER', '').strip().encode('utf-8')
+
+# Valores de ejemplo que no cuentan como clave configurada
+_TOKEN_PEPPER_PLACEHOLDERS = {b'change_me_to_a_random_secret'}
+
+
+def _check_token_pepper():
+    """
+    Exige un EMAIL_TOKEN_PEPPER real
+    
+    Sin clave el hash de un código de 6 dígitos se invierte probando las
+    10^6 combinaciones, así que no se emiten ni se verifican códigos.
+    
+    Raises:
+        ValueError: Si la clave falta o es el valor de ejemplo
+    """
+    if not _TOKEN_PEPPER:
+        raise ValueError("EMAIL_TOKEN_PEPPER no está configurada en .env")
+    if _TOKEN_PEPPER in _TOKEN_PEPPER_PLACEHOLDERS:
+        raise ValueError("EMAIL_TOKEN_PEPPER tiene el valor de ejemplo; genera una clave aleatoria")
+
+
+def _hash_token(code: str) -> str:
+    """HMAC-SHA256 del código con EMAIL_TOKEN_PEPPER; es lo único que se persiste"""
+    _check_token_pepper()
+    return hmac.new(_TOKEN_PEPPER, code.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def _token_candidates(code: str) -> Tuple[str, ...]:
+    """
+    Valores guardados que corresponden a un código
+    
+    El hash actual y, solo para encontrar filas anteriores (siguen siendo
+    válidas hasta expirar), el SHA-256 sin clave y el código en claro.
+    """
+    return tuple(dict.fromkeys((
+        _hash_token(code),
+        hashlib.sha256(code.encode('utf-8')).hexdigest(),
+        code
+    )))
+
+
+def _stored_token_hash(stored: str) -> str:
+    """Hash de un token guardado (las filas anteriores guardan el código en claro)"""
+    return stored if len(stored) == TOKEN_HASH_LENGTH else _hash_token(stored)
+
+
+def _dump_json(payload: Dict[str, Any]) -> bytes:
+    """Serializa el payload a JSON (bytes), con orjson si está disponible"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def _parse_naive_datetime(value: str) -> datetime:
+    """Parsea un timestamp ISO y descarta la zona horaria (se compara con datetime.now())"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.replace(tzinfo=None)
+    return parsed
+
+# ============================================================================
+# PLANTILLA HTML
+# ============================================================================
+
+EMAIL_TEMPLATE_PATH = Path(__file__).parent / 'templates' / 'verification_email.html'
+
+
+@lru_cache(maxsize=1)
+def _load_email_template() -> str:
+    """Lee la plantilla HTML del email una sola vez por proceso"""
+    return EMAIL_TEMPLATE_PATH.read_text(encoding='utf-8')
+
+
+@lru_cache(maxsize=1)
+def _compile_email_template() -> Tuple[Tuple[str, Optional[str]], ...]:
+    """
+    Parte la plantilla una sola vez en (texto_fijo, placeholder)
+    
+    Al renderizar solo se concatenan los fragmentos con los valores, sin
+    volver a analizar la plantilla completa en cada envío.
+    """
+    return tuple(
+        (literal, field_name)
+        for literal, field_name, _, _ in Formatter().parse(_load_email_template())
+    )
+
+
 # ============================================================================
 # ESTRUCTURAS DE DATOS
 # ============================================================================
@@ -508,6 +704,48 @@ class EmailVerificationToken:
     verification_date: Optional[str] = None
     attempts: int = 0
     max_attempts: int = 3
+    
+    # Código en claro: solo existe en el objeto recién generado (para el email),
+    # nunca se guarda ni se cachea
+    code: Optional[str] = field(default=None, repr=False, compare=False, metadata={'persist': False})
+    
+    # Timestamps parseados una sola vez por instancia (se persisten como ISO)
+    @cached_property
+    def created_at_dt(self) -> datetime:
+        """created_at como datetime sin zona horaria"""
+        return _parse_naive_datetime(self.created_at)
+    
+    @cached_property
+    def expires_at_dt(self) -> datetime:
+        """expires_at como datetime sin zona horaria"""
+        return _parse_naive_datetime(self.expires_at)
+    
+    # Equivalentes POSIX para comparar con time.time() sin construir datetimes
+    @cached_property
+    def created_at_ts(self) -> float:
+        """created_at como timestamp POSIX"""
+        return self.created_at_dt.timestamp()
+    
+    @cached_property
+    def expires_at_ts(self) -> float:
+        """expires_at como timestamp POSIX"""
+        return self.expires_at_dt.timestamp()
+
+
+# Campos persistidos del token, resueltos una sola vez; también son las
+# columnas que se leen de email_verifications (en lugar de select('*')).
+#
+# Las consultas asumen estos índices en Supabase:
+#   CREATE INDEX idx_ev_token ON email_verifications (token);
+#   CREATE INDEX idx_ev_user_created ON email_verifications (user_id, created_at DESC);
+#   CREATE INDEX idx_ev_expires ON email_verifications (expires_at) WHERE verified = false;
+# idx_ev_expires es parcial: limpieza y precarga filtran verified = false.
+# Los de token y user_id no pueden serlo: verify_token e is_email_verified
+# necesitan ver también las filas ya verificadas.
+_TOKEN_FIELDS = tuple(
+    f.name for f in fields(EmailVerificationToken) if f.metadata.get('persist', True)
+)
+VERIFICATION_COLUMNS = ','.join(_TOKEN_FIELDS)
 
 
 @dataclass
@@ -519,6 +757,75 @@ class EmailVerificationResult:
     email: Optional[str] = None
 
 
+# ============================================================================
+# ENVÍO POR LOTES
+# ============================================================================
+
+# Destinatario encolado: (user_id, username, email, código)
+VerificationRecipient = Tuple[str, str, str, str]
+
+
+class VerificationEmailDispatcher:
+    """
+    Cola de envíos que agrupa los emails que se acumulan mientras sale el lote anterior
+    
+    No hay ventana de espera: con la cola vacía cada envío sale al momento;
+    bajo carga, lo encolado durante una llamada a SendGrid sale en la siguiente.
+    """
+    
+    def __init__(self, send_batch: Callable[[List[VerificationRecipient]], List[bool]],
+                 max_batch: int):
+        """
+        Args:
+            send_batch: Función que envía un lote y devuelve éxito/fallo por destinatario
+            max_batch: Máximo de destinatarios por lote
+        """
+        self._send_batch = send_batch
+        self.max_batch = max_batch
+        self._queue: 'queue.Queue[Tuple[VerificationRecipient, Future]]' = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="sg-batch", daemon=True)
+        self._worker.start()
+    
+    def enqueue(self, recipient: VerificationRecipient) -> Future:
+        """
+        Encola un destinatario
+        
+        Args:
+            recipient: (user_id, username, email, código)
+            
+        Returns:
+            Future que resuelve a bool cuando se envía su lote
+        """
+        future = Future()
+        self._queue.put((recipient, future))
+        return future
+    
+    def _collect(self) -> List[Tuple[VerificationRecipient, Future]]:
+        """Espera el primer envío y añade, sin esperar, los que ya estén en cola"""
+        items = [self._queue.get()]
+        
+        while len(items) < self.max_batch:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        return items
+    
+    def _run(self):
+        """Bucle del hilo de envío"""
+        while True:
+            items = self._collect()
+            try:
+                results = self._send_batch([recipient for recipient, _ in items])
+            except Exception as e:
+                logger.error("Error enviando lote de verificación: %s", e)
+                results = [False] * len(items)
+            
+            for (_, future), sent in zip(items, results):
+                future.set_result(sent)
+
+
 # ============================================================================
 # CLASE PRINCIPAL
 # ============================================================================
@@ -539,19 +846,109 @@ class EmailVerificationSystem:
         self.frontend_url = os.getenv('FRONTEND_URL', 'http://localhost:3000')
         self.backend_url = os.getenv('BACKEND_URL', 'http://localhost:8000')
         self.expiry_minutes = int(os.getenv('EMAIL_VERIFICATION_EXPIRY_MINUTES', '30'))
+        self.resend_cooldown_seconds = int(os.getenv('EMAIL_RESEND_COOLDOWN_SECONDS', '60'))
+        self.max_attempts_default = int(os.getenv('EMAIL_VERIFICATION_MAX_ATTEMPTS', '3'))
+        
+        # Sin clave HMAC no se arranca (los códigos serían reversibles)
+        _check_token_pepper()
         
         # CLIENTE SUPABASE (reemplaza filesystem)
         self.supabase = get_supabase_client()
         
+        # Caché en proceso de la última verificación por usuario:
+        # user_id -> (instante de carga, token). Se invalida al guardar y
+        # caduca tras un TTL corto por si otro proceso modificó la fila.
+        # Acotada en orden LRU y protegida con lock (handlers concurrentes)
+        self.cache_ttl_seconds = float(os.getenv('EMAIL_VERIFICATION_CACHE_TTL_SECONDS', '5'))
+        self.cache_max_entries = int(os.getenv('EMAIL_VERIFICATION_CACHE_MAX_ENTRIES', '1024'))
+        self.status_cache_ttl_seconds = float(os.getenv('EMAIL_VERIFICATION_STATUS_TTL_SECONDS', '60'))
+        self._cache: 'OrderedDict[str, Tuple[float, EmailVerificationToken]]' = OrderedDict()
+        self._cache_lock = threading.Lock()
+        
+        # Usuarios sin ninguna verificación (resultado negativo), con el mismo
+        # TTL: user_id -> instante de la consulta
+        self._missing: 'OrderedDict[str, float]' = OrderedDict()
+        
+        # Estado mínimo por usuario para can_resend_email sin consultar Supabase:
+        # user_id -> timestamp POSIX de creación. El estado "verificado" sale de
+        # la caché acotada (_cache) con status_cache_ttl_seconds
+        self._created_at: Dict[str, float] = {}
+        
+        # Índice hash(token) -> user_id para resolver verify_token desde la
+        # caché sin consultar Supabase por token. Acotado en orden LRU
+        self._token_index: 'OrderedDict[str, str]' = OrderedDict()
+        
+        # Montículo (expires_at_ts, user_id) de verificaciones pendientes: la
+        # limpieza en proceso solo visita las que ya expiraron
+        self._expiry_heap: List[Tuple[float, str]] = []
+        
+        # user_id -> último expires_at_ts metido en el montículo: recargas y
+        # refrescos de la misma verificación no vuelven a insertarla
+        self._expiry_pushed: 'OrderedDict[str, float]' = OrderedDict()
+        
         # Cliente SendGrid
         if not self.api_key:
             raise ValueError("SENDGRID_API_KEY no está configurada en .env")
         
-        self.sg_client = SendGridAPIClient(self.api_key)
+        # python_http_client abre una conexión TLS nueva por envío; con httpx se
+        # reutiliza la conexión (keep-alive) entre envíos y entre hilos
+        self._http = None
+        if HTTPX_AVAILABLE:
+            self._http = httpx.Client(
+                base_url=SENDGRID_API_HOST,
+                headers={
+                    'Authorization': f'Bearer {self.api_key}',
+                    'Content-Type': 'application/json'
+                },
+                timeout=10.0,
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=100,
+                    max_keepalive_connections=50,
+                    keepalive_expiry=30.0
+                )
+            )
+        
+        # Cliente del SDK solo como alternativa cuando no hay httpx
+        self.sg_client = None
+        if self._http is None:
+            from sendgrid import SendGridAPIClient
+            
+            self.sg_client = SendGridAPIClient(self.api_key)
+        
+        # Último envío por usuario para descartar envíos duplicados (doble clic,
+        # reintentos) dentro del cooldown: user_id -> timestamp POSIX
+        self._recent_sends: Dict[str, float] = {}
+        self._recent_sends_lock = threading.Lock()
         
-        print("EmailVerificationSystem inicializado con Supabase")
-        print(f"Email desde: {self.from_email}")
-        print(f" Expiración: {self.expiry_minutes} minutos")
+        # Pool para enviar emails sin bloquear al llamador (POST HTTPS a SendGrid)
+        self._send_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="sg-send")
+        
+        # Envíos agrupados en lotes (solo con plantilla dinámica: el lote va en
+        # una sola llamada con una personalization por destinatario)
+        self.email_batch_size = int(os.getenv('EMAIL_BATCH_SIZE', '100'))
+        self._dispatcher: Optional[VerificationEmailDispatcher] = None
+        if self.template_id and self.email_batch_size > 1:
+            self._dispatcher = VerificationEmailDispatcher(
+                self._send_verification_batch_each,
+                min(self.email_batch_size, SENDGRID_MAX_PERSONALIZATIONS)
+            )
+        
+        # Limpieza oportunista de expirados desde generate_verification_code,
+        # como máximo una vez por intervalo y fuera del hilo de la petición
+        self.cleanup_interval_seconds = int(os.getenv('EMAIL_VERIFICATION_CLEANUP_INTERVAL_SECONDS', '3600'))
+        self._last_cleanup_ts = 0.0
+        self._cleanup_lock = threading.Lock()
+        
+        # Precarga en segundo plano de verificaciones pendientes (desactivable
+        # con EMAIL_VERIFICATION_PRELOAD=false si la tabla es muy grande)
+        self.preload_limit = int(os.getenv('EMAIL_VERIFICATION_PRELOAD_LIMIT', '500'))
+        if os.getenv('EMAIL_VERIFICATION_PRELOAD', 'true').lower() == 'true':
+            self._send_pool.submit(self._preload_pending_verifications)
+        
+        logger.info("EmailVerificationSystem inicializado con Supabase")
+        logger.info("Email desde: %s", self.from_email)
+        logger.info(" Expiración: %s minutos", self.expiry_minutes)
     
     # ========================================================================
     # GENERACIÓN DE TOKENS
@@ -568,9 +965,29 @@ class EmailVerificationSystem:
         Returns:
             EmailVerificationToken con código
         """
-        # Código de 6 dígitos
-        import random
-        code = ''.join([str(random.randint(0, 9)) for _ in range(6)])
+        verification = self._new_verification(user_id, email)
+        
+        # GUARDAR EN SUPABASE
+        self._save_verification(verification)
+        
+        self._maybe_cleanup()
+        
+        logger.debug("Código generado para %s", user_id)
+        return verification
+    
+    def _new_verification(self, user_id: str, email: str) -> EmailVerificationToken:
+        """
+        Construye una verificación nueva con código de 6 dígitos (sin guardarla)
+        
+        Args:
+            user_id: ID del usuario
+            email: Email a verificar
+            
+        Returns:
+            EmailVerificationToken con código
+        """
+        # Código de 6 dígitos (generador criptográfico, con ceros a la izquierda)
+        code = f"{secrets.randbelow(1_000_000):06d}"
         
         # Timestamps
         now = datetime.now()
@@ -580,18 +997,30 @@ class EmailVerificationSystem:
         verification = EmailVerificationToken(
             user_id=user_id,
             email=email.lower().strip(),
-            token=code,  # Ahora es código de 6 dígitos
+            token=_hash_token(code),  # Solo se guarda el hash del código
             created_at=now.isoformat(),
             expires_at=expires.isoformat(),
-            verified=False
+            verified=False,
+            max_attempts=self.max_attempts_default,
+            code=code
         )
         
-        # GUARDAR EN SUPABASE
-        self._save_verification(verification)
-        
-        print(f"Código generado para {user_id}: {code}")
+        # Los datetimes ya existen: se fijan en las propiedades cacheadas para
+        # no volver a parsear los ISO recién generados
+        verification.created_at_dt = now
+        verification.expires_at_dt = expires
         return verification
     
+    def _maybe_cleanup(self):
+        """Lanza cleanup_expired_verifications en segundo plano si toca por intervalo"""
+        now = time.monotonic()
+        with self._cleanup_lock:
+            if self._last_cleanup_ts and now - self._last_cleanup_ts < self.cleanup_interval_seconds:
+                return
+            self._last_cleanup_ts = now
+        
+        self._send_pool.submit(self.cleanup_expired_verifications)
+    
     # ========================================================================
     # ENVÍO DE EMAILS
     # ========================================================================
@@ -608,41 +1037,262 @@ class EmailVerificationSystem:
         Returns:
             bool indicando éxito/fallo
         """
+        if not self._claim_send(user_id):
+            return True
+        
         try:
             # Generar código de 6 dígitos
             verification = self.generate_verification_code(user_id, email)
+            message = self._build_verification_message(username, email, verification.code)
+        except Exception as e:
+            logger.error("Error en send_verification_email: %s", e)
+            self._release_send(user_id)
+            return False
+        
+        sent = self._deliver_verification_email(message, email)
+        if not sent:
+            self._release_send(user_id)
+        return sent
+    
+    def send_verification_email_async(self, user_id: str, username: str, email: str) -> Future:
+        """
+        Envía email de verificación sin bloquear en la llamada HTTP a SendGrid
+        
+        El código se genera y se guarda de forma síncrona (verify funciona de
+        inmediato); solo el envío se delega al pool de hilos.
+        
+        Args:
+            user_id: ID del usuario
+            username: Nombre del usuario
+            email: Email destino
             
-            # El código a mostrar en el email
-            verification_code = verification.token
+        Returns:
+            Future que resuelve a bool indicando éxito/fallo
+        """
+        if not self._claim_send(user_id):
+            future = Future()
+            future.set_result(True)
+            return future
+        
+        try:
+            verification = self.generate_verification_code(user_id, email)
+            if self._dispatcher is None:
+                message = self._build_verification_message(username, email, verification.code)
+        except Exception as e:
+            logger.error("Error en send_verification_email_async: %s", e)
+            self._release_send(user_id)
+            future = Future()
+            future.set_result(False)
+            return future
+        
+        if self._dispatcher is not None:
+            future = self._dispatcher.enqueue((user_id, username, email, verification.code))
+        else:
+            future = self._send_pool.submit(self._deliver_verification_email, message, email)
+        future.add_done_callback(
+            lambda done: None if done.result() else self._release_send(user_id)
+        )
+        return future
+    
+    def send_verification_emails_bulk(self, recipients: List[Tuple[str, str, str]]) -> Dict[str, bool]:
+        """
+        Envía emails de verificación a varios usuarios
+        
+        Con SENDGRID_TEMPLATE_ID configurado se agrupan en una llamada por cada
+        1000 destinatarios (una personalization por usuario, renderizada por
+        SendGrid). Sin plantilla dinámica se envían en paralelo por el pool.
+        
+        Args:
+            recipients: Lista de (user_id, username, email)
             
-            # Construir email HTML con código
-            html_content = self._build_verification_email_html(
-                username=username,
-                verification_code=verification_code,
-                expiry_minutes=self.expiry_minutes
-            )
+        Returns:
+            Dict user_id -> bool indicando éxito/fallo
+        """
+        results: Dict[str, bool] = {}
+        pending: List[VerificationRecipient] = []
+        verifications: List[EmailVerificationToken] = []
+        
+        for user_id, username, email in recipients:
+            if not self._claim_send(user_id):
+                results[user_id] = True
+                continue
+            verification = self._new_verification(user_id, email)
+            verifications.append(verification)
+            pending.append((user_id, username, email, verification.code))
+        
+        # Todas las filas nuevas en un único INSERT en lugar de uno por usuario
+        try:
+            self._save_verifications_bulk(verifications)
+        except Exception as e:
+            logger.error("Error en send_verification_emails_bulk: %s", e)
+            for user_id, _, _, _ in pending:
+                self._release_send(user_id)
+                results[user_id] = False
+            return results
+        self._maybe_cleanup()
+        
+        if self.template_id:
+            for start in range(0, len(pending), SENDGRID_MAX_PERSONALIZATIONS):
+                batch = pending[start:start + SENDGRID_MAX_PERSONALIZATIONS]
+                for (user_id, _, _, _), sent in zip(batch, self._send_verification_batch_each(batch)):
+                    results[user_id] = sent
+        else:
+            futures = {
+                user_id: self._send_pool.submit(
+                    self._deliver_verification_email,
+                    self._build_verification_message(username, email, code),
+                    email
+                )
+                for user_id, username, email, code in pending
+            }
+            for user_id, future in futures.items():
+                results[user_id] = future.result()
+        
+        for user_id, _, _, _ in pending:
+            if not results[user_id]:
+                self._release_send(user_id)
+        
+        return results
+    
+    def _send_verification_batch(self, batch: List[VerificationRecipient]) -> bool:
+        """Envía un lote con una sola llamada a SendGrid (plantilla dinámica)"""
+        message = self._build_bulk_verification_message(batch)
+        return self._deliver_verification_email(message, f"{len(batch)} destinatarios")
+    
+    def _send_verification_batch_each(self, batch: List[VerificationRecipient]) -> List[bool]:
+        """
+        Envía un lote y, si SendGrid lo rechaza, reintenta destinatario a destinatario
+        
+        Un único destinatario inválido hace fallar la llamada entera; el
+        reintento individual evita que arrastre al resto del lote.
+        
+        Args:
+            batch: Lista de (user_id, username, email, código)
             
-            # Crear mensaje de SendGrid
-            message = Mail(
-                from_email=Email(self.from_email, self.from_name),
-                to_emails=To(email),
-                subject='Código de Verificación - Auth-Gesture',
-                html_content=Content("text/html", html_content)
-            )
+        Returns:
+            Lista de bool (éxito/fallo) en el mismo orden que batch
+        """
+        try:
+            if self._send_verification_batch(batch):
+                return [True] * len(batch)
+        except Exception as e:
+            logger.error("Error enviando lote de verificación: %s", e)
+        
+        if len(batch) == 1:
+            return [False]
+        
+        logger.warning("Lote de %s destinatarios rechazado - reintentando uno a uno", len(batch))
+        results = []
+        for recipient in batch:
+            try:
+                results.append(self._send_verification_batch([recipient]))
+            except Exception as e:
+                logger.error("Error enviando verificación a %s: %s", recipient[0], e)
+                results.append(False)
+        return results
+    
+    def _build_bulk_verification_message(self, batch: List[VerificationRecipient]) -> 'Mail':
+        """Construye un único mensaje con una personalization por destinatario"""
+        from sendgrid.helpers.mail import Mail, Email, To, Personalization
+        
+        message = Mail(from_email=Email(self.from_email, self.from_name))
+        message.template_id = self.template_id
+        
+        for _, username, email, code in batch:
+            personalization = Personalization()
+            personalization.add_to(To(email))
+            personalization.dynamic_template_data = {
+                'username': username,
+                'verification_code': code,
+                'expiry_minutes': self.expiry_minutes
+            }
+            message.add_personalization(personalization)
+        
+        return message
+    
+    def _claim_send(self, user_id: str) -> bool:
+        """
+        Registra un envío y descarta duplicados dentro del cooldown
+        
+        El instante se toma antes de generar el código, así que nunca es
+        posterior a created_at y no bloquea un reenvío ya permitido por
+        can_resend_email. Si el último código ya fue verificado se permite
+        enviar otro.
+        
+        Args:
+            user_id: ID del usuario
+            
+        Returns:
+            bool indicando si se debe enviar
+        """
+        now = time.time()
+        cooldown = self.resend_cooldown_seconds
+        
+        with self._recent_sends_lock:
+            last_sent = self._recent_sends.get(user_id)
+            if (last_sent is not None and now - last_sent < cooldown
+                    and not self._cached_verified(user_id)):
+                logger.info("Envío duplicado descartado para %s", user_id)
+                return False
             
-            # Enviar con SendGrid
-            response = self.sg_client.send(message)
+            # Podar entradas fuera del cooldown
+            stale_users = [uid for uid, ts in self._recent_sends.items() if now - ts >= cooldown]
+            for uid in stale_users:
+                del self._recent_sends[uid]
+            
+            self._recent_sends[user_id] = now
+            return True
+    
+    def _release_send(self, user_id: str):
+        """Libera el registro de envío tras un fallo para permitir reintentar"""
+        with self._recent_sends_lock:
+            self._recent_sends.pop(user_id, None)
+    
+    def _build_verification_message(self, username: str, email: str, verification_code: str) -> 'Mail':
+        """Construye el mensaje de SendGrid con el código de verificación"""
+        from sendgrid.helpers.mail import Mail, Email, To, Content
+        
+        # Con plantilla dinámica SendGrid renderiza el HTML: solo viajan los datos
+        if self.template_id:
+            message = Mail(from_email=Email(self.from_email, self.from_name), to_emails=To(email))
+            message.template_id = self.template_id
+            message.dynamic_template_data = {
+                'username': username,
+                'verification_code': verification_code,
+                'expiry_minutes': self.expiry_minutes
+            }
+            return message
+        
+        html_content = self._build_verification_email_html(
+            username=username,
+            verification_code=verification_code,
+            expiry_minutes=self.expiry_minutes
+        )
+        
+        return Mail(
+            from_email=Email(self.from_email, self.from_name),
+            to_emails=To(email),
+            subject='Código de Verificación - Auth-Gesture',
+            html_content=Content("text/html", html_content)
+        )
+    
+    def _deliver_verification_email(self, message: 'Mail', email: str) -> bool:
+        """Envía el mensaje con SendGrid"""
+        try:
+            if self._http is not None:
+                response = self._http.post('/v3/mail/send', content=_dump_json(message.get()))
+            else:
+                response = self.sg_client.send(message)
             
             if response.status_code in [200, 201, 202]:
-                print(f"Email enviado exitosamente a {email}")
-                print(f"Código de verificación: {verification_code}")
+                logger.info("Email enviado exitosamente a %s", email)
                 return True
             else:
-                print(f"Error enviando email: {response.status_code}")
+                logger.error("Error enviando email: %s", response.status_code)
                 return False
                 
         except Exception as e:
-            print(f"Error en send_verification_email: {e}")
+            logger.error("Error en send_verification_email: %s", e)
             return False
     
     # ========================================================================
@@ -663,7 +1313,7 @@ class EmailVerificationSystem:
             # BUSCAR TOKEN EN SUPABASE
             verification = self._find_verification_by_token(token)
             
-            if not verification:
+            if not verification or not self.token_matches(verification, token):
                 return EmailVerificationResult(
                     success=False,
                     message="Token inválido o no encontrado"
@@ -679,8 +1329,7 @@ class EmailVerificationSystem:
                 )
             
             # Verificar expiración
-            expires_at = datetime.fromisoformat(verification.expires_at)
-            if datetime.now() > expires_at:
+            if time.time() > verification.expires_at_ts:
                 return EmailVerificationResult(
                     success=False,
                     message="El token ha expirado. Solicita uno nuevo."
@@ -696,12 +1345,18 @@ class EmailVerificationSystem:
             # Marcar como verificado
             verification.verified = True
             verification.verification_date = datetime.now().isoformat()
-            verification.attempts += 1
             
-            # GUARDAR CAMBIOS EN SUPABASE
-            self._save_verification(verification)
+            # GUARDAR CAMBIOS EN SUPABASE (falla si otra petición ya lo consumió;
+            # el intento se suma en el mismo UPDATE condicional)
+            if not self._save_verification(verification):
+                return EmailVerificationResult(
+                    success=False,
+                    message="Este email ya fue verificado anteriormente",
+                    user_id=verification.user_id,
+                    email=verification.email
+                )
             
-            print(f"Email verificado exitosamente: {verification.email}")
+            logger.info("Email verificado exitosamente: %s", verification.email)
             
             return EmailVerificationResult(
                 success=True,
@@ -711,12 +1366,31 @@ class EmailVerificationSystem:
             )
             
         except Exception as e:
-            print(f"Error verificando token: {e}")
+            logger.error("Error verificando token: %s", e)
             return EmailVerificationResult(
                 success=False,
                 message=f"Error verificando token: {str(e)}"
             )
     
+    def token_matches(self, verification: EmailVerificationToken, submitted: str) -> bool:
+        """
+        Compara el hash del código enviado con el almacenado en tiempo constante
+        
+        Args:
+            verification: Verificación cargada
+            submitted: Código introducido por el usuario
+            
+        Returns:
+            bool indicando si coinciden
+        """
+        if not submitted:
+            return False
+        stored = verification.token.encode('utf-8')
+        return any(
+            hmac.compare_digest(stored, candidate.encode('utf-8'))
+            for candidate in _token_candidates(submitted)
+        )
+    
     # ========================================================================
     # VERIFICACIÓN DE ESTADO
     # ========================================================================
@@ -731,7 +1405,11 @@ class EmailVerificationSystem:
         Returns:
             bool indicando si está verificado
         """
-        verification = self._load_verification(user_id)
+        # El estado cambia poco y los cambios locales refrescan la caché: se
+        # admite una entrada más antigua que para verify/resend
+        verification = self._cache_get(user_id, self.status_cache_ttl_seconds)
+        if verification is None:
+            verification = self._load_verification(user_id)
         if verification:
             return verification.verified
         return False
@@ -746,6 +1424,19 @@ class EmailVerificationSystem:
         Returns:
             (puede_reenviar, mensaje)
         """
+        cooldown = self.resend_cooldown_seconds
+        
+        # Atajo sin I/O: estado ya conocido en este proceso (caché acotada)
+        if self._cached_verified(user_id):
+            return False, "Email ya verificado"
+        
+        created_ts = self._created_at.get(user_id)
+        if created_ts is not None:
+            elapsed = time.time() - created_ts
+            if elapsed < cooldown:
+                remaining = int(cooldown - elapsed)
+                return False, f"Espera {remaining} segundos antes de reenviar"
+        
         verification = self._load_verification(user_id)
         
         if not verification:
@@ -754,10 +1445,8 @@ class EmailVerificationSystem:
         if verification.verified:
             return False, "Email ya verificado"
         
-        # Verificar cooldown (60 segundos)
-        cooldown = int(os.getenv('EMAIL_RESEND_COOLDOWN_SECONDS', '60'))
-        created_at = datetime.fromisoformat(verification.created_at)
-        elapsed = (datetime.now() - created_at).total_seconds()
+        # Verificar cooldown
+        elapsed = time.time() - verification.created_at_ts
         
         if elapsed < cooldown:
             remaining = int(cooldown - elapsed)
@@ -772,108 +1461,15 @@ class EmailVerificationSystem:
     def _build_verification_email_html(self, username: str, verification_code: str, expiry_minutes: int) -> str:
         """Construye HTML del email con código de verificación - Diseño del sistema"""
         
-        html = f"""
-        <!DOCTYPE html>
-        <html lang="es">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Código de Verificación</title>
-        </head>
-        <body style="margin: 0; padding: 0; font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif; background: linear-gradient(135deg, #1e3a8a 0%, #0891b2 100%); min-height: 100vh;">
-            <table role="presentation" cellpadding="0" cellspacing="0" border="0" width="100%" style="background: linear-gradient(135deg, #1e3a8a 0%, #0891b2 100%); min-height: 100vh; padding: 40px 20px;">
-                <tr>
-                    <td align="center">
-                        <table role="presentation" cellpadding="0" cellspacing="0" border="0" width="100%" style="max-width: 600px; background-color: #ffffff; border-radius: 16px; box-shadow: 0 20px 50px rgba(0, 0, 0, 0.3); overflow: hidden;">
-                            
-                            <!-- Header con gradiente -->
-                            <tr>
-                                <td style="background: linear-gradient(135deg, #1e3a8a 0%, #0891b2 100%); padding: 40px 40px 30px 40px; text-align: center;">
-                                    <h1 style="margin: 0; color: #ffffff; font-size: 32px; font-weight: 700; letter-spacing: -0.5px;">
-                                        Auth-Gesture
-                                    </h1>
-                                    <p style="margin: 8px 0 0 0; color: rgba(255, 255, 255, 0.9); font-size: 16px; font-weight: 400;">
-                                        Autenticación Biométrica por Gestos
-                                    </p>
-                                </td>
-                            </tr>
-                            
-                            <!-- Contenido -->
-                            <tr>
-                                <td style="padding: 50px 40px;">
-                                    <h2 style="margin: 0 0 16px 0; color: #1e293b; font-size: 24px; font-weight: 700;">
-                                        Hola {username}
-                                    </h2>
-                                    
-                                    <p style="margin: 0 0 24px 0; color: #475569; font-size: 16px; line-height: 1.6;">
-                                        Para completar tu registro, utiliza el siguiente código de verificación:
-                                    </p>
-                                    
-                                    <!-- Código de verificación -->
-                                    <table role="presentation" cellpadding="0" cellspacing="0" border="0" width="100%">
-                                        <tr>
-                                            <td align="center" style="padding: 32px 0;">
-                                                <div style="background: linear-gradient(135deg, #1e3a8a 0%, #0891b2 100%); border-radius: 12px; padding: 24px 40px; display: inline-block;">
-                                                    <p style="margin: 0; color: rgba(255, 255, 255, 0.7); font-size: 12px; font-weight: 600; text-transform: uppercase; letter-spacing: 1px; margin-bottom: 8px;">
-                                                        Código de verificación
-                                                    </p>
-                                                    <p style="margin: 0; color: #ffffff; font-size: 42px; font-weight: 700; letter-spacing: 8px; font-family: 'Courier New', monospace;">
-                                                        {verification_code}
-                                                    </p>
-                                                </div>
-                                            </td>
-                                        </tr>
-                                    </table>
-                                    
-                                    <!-- Información -->
-                                    <div style="background-color: #f1f5f9; border-radius: 8px; padding: 20px; margin: 24px 0;">
-                                        <p style="margin: 0 0 12px 0; color: #334155; font-size: 14px; line-height: 1.6;">
-                                            <strong style="color: #1e293b;">Importante:</strong> Este código expirará en <strong>{expiry_minutes} minutos</strong>.
-                                        </p>
-                                        <p style="margin: 0; color: #334155; font-size: 14px; line-height: 1.6;">
-                                            Si no solicitaste este código, puedes ignorar este mensaje.
-                                        </p>
-                                    </div>
-                                    
-                                    <p style="margin: 24px 0 0 0; color: #64748b; font-size: 14px; line-height: 1.6;">
-                                        Una vez verificado, podrás completar tu registro biométrico.
-                                    </p>
-                                </td>
-                            </tr>
-                            
-                            <!-- Footer -->
-                            <tr>
-                                <td style="background-color: #f8fafc; padding: 30px 40px; border-top: 1px solid #e2e8f0;">
-                                    <p style="margin: 0 0 8px 0; color: #64748b; font-size: 13px; line-height: 1.5;">
-                                        Este correo fue enviado por <strong style="color: #475569;">Auth-Gesture</strong>
-                                    </p>
-                                    <p style="margin: 0; color: #94a3b8; font-size: 12px; line-height: 1.5;">
-                                        authgesture.com | Sistema de autenticación biométrica por gestos
-                                    </p>
-                                </td>
-                            </tr>
-                            
-                        </table>
-                        
-                        <!-- Texto legal -->
-                        <table role="presentation" cellpadding="0" cellspacing="0" border="0" width="100%" style="max-width: 600px; margin-top: 20px;">
-                            <tr>
-                                <td style="text-align: center; padding: 0 20px;">
-                                    <p style="margin: 0; color: rgba(255, 255, 255, 0.8); font-size: 12px; line-height: 1.5;">
-                                        Este es un correo automático, por favor no respondas.
-                                    </p>
-                                </td>
-                            </tr>
-                        </table>
-                        
-                    </td>
-                </tr>
-            </table>
-        </body>
-        </html>
-        """
-        
-        return html
+        values = {
+            'username': html.escape(username),
+            'verification_code': html.escape(verification_code),
+            'expiry_minutes': str(expiry_minutes)
+        }
+        return ''.join([
+            literal + values[field_name] if field_name is not None else literal
+            for literal, field_name in _compile_email_template()
+        ])
     
     # ========================================================================
     # PERSISTENCIA CON SUPABASE (REEMPLAZÓ FILESYSTEM)
@@ -906,38 +1502,93 @@ class EmailVerificationSystem:
     #         print(f"Error guardando verificación en Supabase: {e}")
     #         raise
     
-    def _save_verification(self, verification: EmailVerificationToken):
-        """Guarda verificación en Supabase"""
+    def _save_verification(self, verification: EmailVerificationToken) -> bool:
+        """
+        Guarda verificación en Supabase
+        
+        Args:
+            verification: Verificación a guardar
+            
+        Returns:
+            bool: False si al marcarla como verificada ya lo estaba (otra
+            petición la consumió antes) o agotó los intentos; True en
+            cualquier otro caso
+        """
         try:
-            verification_data = {
-                'user_id': verification.user_id,
-                'email': verification.email,
-                'token': verification.token,
-                'created_at': verification.created_at,
-                'expires_at': verification.expires_at,
-                'verified': verification.verified,
-                'verification_date': verification.verification_date,
-                'attempts': verification.attempts,
-                'max_attempts': verification.max_attempts
-            }
+            self.invalidate(verification.user_id)
             
-            # Si está marcando como verified, hacer UPDATE
+            # Si está marcando como verified, hacer UPDATE solo de las columnas
+            # que cambian al verificar (el resto de la fila ya está guardada).
+            # Compare-and-set: solo se actualiza si sigue sin verificar y con
+            # los mismos intentos que se leyeron (y por debajo del máximo), así
+            # dos verificaciones concurrentes del mismo código no triunfan ambas
+            # y el contador no se pisa con un valor calculado sobre datos viejos
             if verification.verified and verification.verification_date:
-                self.supabase.table('email_verifications')\
-                    .update(verification_data)\
+                loaded_attempts = verification.attempts
+                response = self.supabase.table('email_verifications')\
+                    .update({
+                        'verified': verification.verified,
+                        'verification_date': verification.verification_date,
+                        'attempts': loaded_attempts + 1
+                    })\
                     .eq('user_id', verification.user_id)\
                     .eq('token', verification.token)\
+                    .eq('verified', False)\
+                    .eq('attempts', loaded_attempts)\
+                    .lt('attempts', verification.max_attempts)\
                     .execute()
+                
+                if not response.data:
+                    logger.info("Verificación ya consumida para %s", verification.user_id)
+                    return False
+                verification.attempts = loaded_attempts + 1
             else:
-                # Crear nueva verificación
+                # Crear nueva verificación. Diccionario plano sobre los campos
+                # precalculados (sin asdict): el dataclass solo tiene campos
+                # primitivos, no hace falta copia profunda
+                verification_data = {name: getattr(verification, name) for name in _TOKEN_FIELDS}
                 self.supabase.table('email_verifications')\
                     .insert(verification_data)\
                     .execute()
             
-            print(f"Verificación guardada en Supabase para {verification.user_id}")
+            self._remember_verification(verification)
+            
+            logger.debug("Verificación guardada en Supabase para %s", verification.user_id)
+            return True
             
         except Exception as e:
-            print(f"Error guardando verificación en Supabase: {e}")
+            logger.error("Error guardando verificación en Supabase: %s", e)
+            raise
+    
+    def _save_verifications_bulk(self, verifications: List[EmailVerificationToken]):
+        """
+        Guarda varias verificaciones nuevas en Supabase con un solo INSERT
+        
+        Args:
+            verifications: Verificaciones recién generadas (sin verificar)
+        """
+        if not verifications:
+            return
+        
+        try:
+            for verification in verifications:
+                self.invalidate(verification.user_id)
+            
+            rows = [
+                {name: getattr(verification, name) for name in _TOKEN_FIELDS}
+                for verification in verifications
+            ]
+            self.supabase.table('email_verifications')\
+                .insert(rows)\
+                .execute()
+            
+            for verification in verifications:
+                self._remember_verification(verification)
+            
+            logger.debug("%d verificaciones guardadas en Supabase", len(verifications))
+            
+        except Exception as e:
+            logger.error("Error guardando verificaciones en Supabase: %s", e)
             raise
     
     # def _load_verification(self, user_id: str) -> Optional[EmailVerificationToken]:
@@ -968,79 +1619,293 @@ class EmailVerificationSystem:
     #         return None
     
     def _load_verification(self, user_id: str) -> Optional[EmailVerificationToken]:
-        """Carga verificación desde Supabase"""
+        """Carga verificación desde Supabase (o desde la caché en proceso si está vigente)"""
+        cached = self._cache_get(user_id)
+        if cached is not None:
+            return cached
+        
+        with self._cache_lock:
+            missing_ts = self._missing.get(user_id)
+            if missing_ts is not None:
+                if time.monotonic() - missing_ts < self.cache_ttl_seconds:
+                    return None
+                del self._missing[user_id]
+        
         try:
             # SELECT DESDE SUPABASE - ORDENAR POR MÁS RECIENTE
             response = self.supabase.table('email_verifications')\
-                .select('*')\
+                .select(VERIFICATION_COLUMNS)\
                 .eq('user_id', user_id)\
                 .order('created_at', desc=True)\
                 .limit(1)\
                 .execute()
             
             if not response.data:
+                with self._cache_lock:
+                    self._missing[user_id] = time.monotonic()
+                    self._missing.move_to_end(user_id)
+                    while len(self._missing) > self.cache_max_entries:
+                        self._missing.popitem(last=False)
                 return None
             
-            data = response.data[0]
-            
-            return EmailVerificationToken(
-                user_id=data['user_id'],
-                email=data['email'],
-                token=data['token'],
-                created_at=data['created_at'],
-                expires_at=data['expires_at'],
-                verified=data.get('verified', False),
-                verification_date=data.get('verification_date'),
-                attempts=data.get('attempts', 0),
-                max_attempts=data.get('max_attempts', 3)
-            )
+            verification = self._row_to_verification(response.data[0])
+            self._remember_verification(verification)
+            
+            return verification
             
         except Exception as e:
-            print(f"Error cargando verificación desde Supabase: {e}")
+            logger.error("Error cargando verificación desde Supabase: %s", e)
             return None
     
+    @staticmethod
+    def _row_to_verification(data: Dict[str, Any]) -> EmailVerificationToken:
+        """Construye el token desde una fila de email_verifications"""
+        return EmailVerificationToken(
+            user_id=data['user_id'],
+            email=data['email'],
+            token=data['token'],
+            created_at=data['created_at'],
+            expires_at=data['expires_at'],
+            verified=data.get('verified', False),
+            verification_date=data.get('verification_date'),
+            attempts=data.get('attempts', 0),
+            max_attempts=data.get('max_attempts', 3)
+        )
+    
+    def _cache_get(self, user_id: str, ttl: Optional[float] = None) -> Optional[EmailVerificationToken]:
+        """
+        Devuelve una copia de la verificación en caché si sigue vigente
+        
+        Args:
+            user_id: ID del usuario
+            ttl: Vigencia en segundos (por defecto cache_ttl_seconds)
+        """
+        if ttl is None:
+            ttl = self.cache_ttl_seconds
+        
+        with self._cache_lock:
+            cached = self._cache.get(user_id)
+            if cached is None:
+                return None
+            age = time.monotonic() - cached[0]
+            if age >= ttl:
+                # Se conserva mientras pueda servir a la consulta de estado
+                if age >= max(self.cache_ttl_seconds, self.status_cache_ttl_seconds):
+                    del self._cache[user_id]
+                return None
+            self._cache.move_to_end(user_id)
+            # Copia: los llamadores modifican el objeto antes de guardarlo
+            return replace(cached[1])
+    
+    def _cached_verified(self, user_id: str) -> bool:
+        """
+        Indica si la caché tiene al usuario como verificado (sin I/O)
+        
+        Usa la misma vigencia que is_email_verified; sin entrada vigente se
+        devuelve False y el llamador consulta Supabase si lo necesita.
+        """
+        verification = self._cache_get(user_id, self.status_cache_ttl_seconds)
+        return verification is not None and verification.verified
+    
+    def invalidate(self, user_id: str):
+        """
+        Descarta la verificación en caché de un usuario
+        
+        Args:
+            user_id: ID del usuario
+        """
+        with self._cache_lock:
+            self._cache.pop(user_id, None)
+            self._missing.pop(user_id, None)
+    
+    def _remember_verification(self, verification: EmailVerificationToken):
+        """Actualiza la caché y el estado mínimo por usuario tras cargar o guardar"""
+        user_id = verification.user_id
+        with self._cache_lock:
+            self._missing.pop(user_id, None)
+            self._cache[user_id] = (time.monotonic(), replace(verification, code=None))
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.cache_max_entries:
+                self._cache.popitem(last=False)
+            
+            token_key = _stored_token_hash(verification.token)
+            self._token_index[token_key] = user_id
+            self._token_index.move_to_end(token_key)
+            while len(self._token_index) > MAX_INDEXED_TOKENS:
+                self._token_index.popitem(last=False)
+            
+            if not verification.verified:
+                try:
+                    self._push_expiry(user_id, verification.expires_at_ts)
+                except (TypeError, ValueError):
+                    pass
+        
+        try:
+            self._created_at[user_id] = verification.created_at_ts
+        except (TypeError, ValueError):
+            self._created_at.pop(user_id, None)
+    
+    def _push_expiry(self, user_id: str, expires_at_ts: float):
+        """
+        Registra la caducidad de un usuario en el montículo (con _cache_lock)
+        
+        Solo se inserta si cambió respecto a la última registrada. Si el
+        montículo supera el doble del máximo se descartan los usuarios más
+        antiguos y se reconstruye solo con las entradas vigentes
+        """
+        if self._expiry_pushed.get(user_id) == expires_at_ts:
+            return
+        self._expiry_pushed[user_id] = expires_at_ts
+        self._expiry_pushed.move_to_end(user_id)
+        heapq.heappush(self._expiry_heap, (expires_at_ts, user_id))
+        
+        if len(self._expiry_heap) > 2 * MAX_EXPIRY_ENTRIES:
+            while len(self._expiry_pushed) > MAX_EXPIRY_ENTRIES:
+                self._expiry_pushed.popitem(last=False)
+            self._expiry_heap = [(ts, uid) for uid, ts in self._expiry_pushed.items()]
+            heapq.heapify(self._expiry_heap)
+    
     def _find_verification_by_token(self, token: str) -> Optional[EmailVerificationToken]:
-        """Busca verificación por token en Supabase"""
+        """Busca verificación por token (índice en proceso, luego Supabase)"""
+        # Token emitido o cargado en este proceso: se resuelve por user_id,
+        # normalmente desde la caché. Si el usuario ya tiene otro código, la
+        # entrada del índice está obsoleta y se consulta Supabase
+        key = _hash_token(token)
+        user_id = self._token_index.get(key)
+        if user_id is not None:
+            verification = self._load_verification(user_id)
+            if verification and self.token_matches(verification, token):
+                return verification
+            with self._cache_lock:
+                self._token_index.pop(key, None)
+        
         try:
-            # SELECT POR TOKEN EN SUPABASE
-            response = self.supabase.table('email_verifications').select('*').eq('token', token).execute()
+            # SELECT POR TOKEN EN SUPABASE - solo la fila más reciente; el filtro
+            # por hash se resuelve en la base de datos (también los formatos de
+            # filas anteriores, ver _token_candidates)
+            response = self.supabase.table('email_verifications')\
+                .select(VERIFICATION_COLUMNS)\
+                .in_('token', list(_token_candidates(token)))\
+                .order('created_at', desc=True)\
+                .limit(1)\
+                .execute()
             
             if not response.data:
                 return None
             
-            data = response.data[0]
-            
-            return EmailVerificationToken(
-                user_id=data['user_id'],
-                email=data['email'],
-                token=data['token'],
-                created_at=data['created_at'],
-                expires_at=data['expires_at'],
-                verified=data.get('verified', False),
-                verification_date=data.get('verification_date'),
-                attempts=data.get('attempts', 0),
-                max_attempts=data.get('max_attempts', 3)
-            )
+            return self._row_to_verification(response.data[0])
             
         except Exception as e:
-            print(f"Error buscando token en Supabase: {e}")
+            logger.error("Error buscando token en Supabase: %s", e)
             return None
     
-    def cleanup_expired_verifications(self):
-        """Limpia verificaciones expiradas de Supabase"""
+    def _preload_pending_verifications(self):
+        """
+        Carga en memoria las verificaciones pendientes y no expiradas
+        
+        Se ejecuta una vez al arrancar, fuera del camino de las peticiones:
+        abre la conexión con Supabase y deja listo el estado por usuario
+        (creación y caché) que usan can_resend_email y _load_verification.
+        """
+        try:
+            response = self.supabase.table('email_verifications')\
+                .select(VERIFICATION_COLUMNS)\
+                .eq('verified', False)\
+                .gt('expires_at', datetime.now().isoformat())\
+                .order('created_at')\
+                .limit(self.preload_limit)\
+                .execute()
+            
+            # Orden ascendente: la fila más reciente de cada usuario queda la última
+            for row in response.data or []:
+                self._remember_verification(self._row_to_verification(row))
+            
+            logger.info("Verificaciones pendientes precargadas: %s", len(response.data or []))
+            
+        except Exception as e:
+            logger.error("Error precargando verificaciones desde Supabase: %s", e)
+    
+    def cleanup_expired_verifications(self) -> int:
+        """
+        Limpia verificaciones expiradas de Supabase
+        
+        Returns:
+            Número de verificaciones eliminadas
+        """
+        count = 0
         try:
             now = datetime.now().isoformat()
             
-            # DELETE DESDE SUPABASE
-            response = self.supabase.table('email_verifications').delete().lt('expires_at', now).eq('verified', False).execute()
+            # DELETE DESDE SUPABASE por lotes: cada sentencia borra como mucho
+            # CLEANUP_BATCH_SIZE filas (bloqueos acotados en tablas grandes).
+            # Se repiten los filtros en el DELETE para no borrar nada que no
+            # haya expirado; solo se pide el conteo, no las filas borradas
+            for _ in range(CLEANUP_MAX_BATCHES):
+                batch = self.supabase.table('email_verifications')\
+                    .select('token')\
+                    .lt('expires_at', now)\
+                    .eq('verified', False)\
+                    .order('expires_at')\
+                    .limit(CLEANUP_BATCH_SIZE)\
+                    .execute()
+                
+                tokens = [row['token'] for row in batch.data or []]
+                if not tokens:
+                    break
+                
+                response = self.supabase.table('email_verifications')\
+                    .delete(count='exact', returning='minimal')\
+                    .in_('token', tokens)\
+                    .lt('expires_at', now)\
+                    .eq('verified', False)\
+                    .execute()
+                
+                deleted = response.count or 0
+                count += deleted
+                
+                # Si el DELETE no borró todo lo seleccionado (permisos/RLS o
+                # filas verificadas entre medias) el siguiente SELECT devolvería
+                # las mismas filas: se para aquí
+                if len(tokens) < CLEANUP_BATCH_SIZE or deleted < len(tokens):
+                    break
+            else:
+                logger.warning("Limpieza detenida tras %s lotes; quedan expirados pendientes",
+                               CLEANUP_MAX_BATCHES)
             
-            count = len(response.data) if response.data else 0
+            # Descartar el estado en proceso de las verificaciones que acaban de
+            # expirar: solo se sacan del montículo las vencidas, O(k log N)
+            now_ts = time.time()
+            expiry_seconds = self.expiry_minutes * 60
+            with self._cache_lock:
+                while self._expiry_heap and self._expiry_heap[0][0] < now_ts:
+                    expires_ts, user_id = heapq.heappop(self._expiry_heap)
+                    
+                    # Entrada obsoleta: el usuario tiene una caducidad más reciente
+                    if self._expiry_pushed.get(user_id) != expires_ts:
+                        continue
+                    del self._expiry_pushed[user_id]
+                    
+                    # La entrada puede estar obsoleta (nuevo código o ya verificado)
+                    cached = self._cache.get(user_id)
+                    if cached is not None:
+                        verification = cached[1]
+                        if not verification.verified and verification.expires_at_ts < now_ts:
+                            del self._cache[user_id]
+                            self._token_index.pop(_stored_token_hash(verification.token), None)
+                    
+                    # Con el token expirado el cooldown de reenvío ya pasó: el
+                    # instante de creación deja de aportar y se libera
+                    created_ts = self._created_at.get(user_id)
+                    if created_ts is not None and now_ts - created_ts > expiry_seconds:
+                        self._created_at.pop(user_id, None)
             
             if count > 0:
-                print(f"🗑️  Limpiados {count} tokens expirados desde Supabase")
+                logger.info("🗑️  Limpiados %s tokens expirados desde Supabase", count)
             
         except Exception as e:
-            print(f"Error limpiando verificaciones en Supabase: {e}")
+            logger.error("Error limpiando verificaciones en Supabase: %s", e)
+        
+        return count
 
 
 # ============================================================================
@@ -1048,10 +1913,15 @@ class EmailVerificationSystem:
 # ============================================================================
 
 _email_verification_system = None
+_email_verification_system_lock = threading.Lock()
 
 def get_email_verification_system() -> EmailVerificationSystem:
     """Obtiene instancia global del sistema"""
     global _email_verification_system
     if _email_verification_system is None:
-        _email_verification_system = EmailVerificationSystem()
+        # Doble comprobación: peticiones concurrentes al arrancar no deben
+        # crear varias instancias (cada una abre clientes, pools y precarga)
+        with _email_verification_system_lock:
+            if _email_verification_system is None:
+                _email_verification_system = EmailVerificationSystem()
     return _email_verification_system
\ No newline at end of file
@@ -299,6 +299,10 @@ class RealSiameseAnatomicalNetwork:
                             if bootstrap_features is not None:
                                 features_to_process = []
                                 
+                                # ndarray (BiometricDatabase con sidecars .npy) -> misma forma que el JSON
+                                if isinstance(bootstrap_features, np.ndarray):
+                                    bootstrap_features = bootstrap_features.tolist()
+                                
                                 if isinstance(bootstrap_features, list) and len(bootstrap_features) > 0:
                                     if isinstance(bootstrap_features[0], list):
                                         features_to_process = bootstrap_features
@@ -1969,8 +1973,8 @@ class RealSiameseAnatomicalNetwork:
                     print(f"[FASE 1]       Verificando campo 'bootstrap_features'...")
                     
                     # CARGAR FEATURES 180D
-                    if template.metadata.get('bootstrap_features'):
-                        bootstrap_features = template.metadata.get('bootstrap_features')
+                    bootstrap_features = template.metadata.get('bootstrap_features')
+                    if bootstrap_features is not None and len(bootstrap_features) > 0:
                         
                         print(f"[FASE 1]       Campo 'bootstrap_features' encontrado")
                         print(f"[FASE 1]       Tipo de datos: {type(bootstrap_features)}")
@@ -723,8 +723,9 @@ class RealSiameseDynamicNetwork:
                     temporal_templates = []
                     for template in user_templates_list:
                         template_type_str = str(template.template_type).lower()
+                        # Lista (JSON/Supabase) o ndarray (BiometricDatabase con sidecars .npy)
                         has_temporal_sequence = (template.metadata.get('temporal_sequence') is not None and 
-                                               isinstance(template.metadata.get('temporal_sequence'), list) and
+                                               isinstance(template.metadata.get('temporal_sequence'), (list, np.ndarray)) and
                                                len(template.metadata.get('temporal_sequence', [])) >= 5)
                         has_individual_sequences = (template.metadata.get('individual_temporal_sequences') is not None and
                                                   isinstance(template.metadata.get('individual_temporal_sequences'), list) and
@@ -744,7 +745,7 @@ class RealSiameseDynamicNetwork:
                             individual_sequences = template.metadata.get('individual_temporal_sequences', [])
                             
                             has_individual_data = individual_sequences and len(individual_sequences) > 1
-                            has_temporal_sequence = temporal_sequence and len(temporal_sequence) >= 5
+                            has_temporal_sequence = temporal_sequence is not None and len(temporal_sequence) >= 5
                             
                             if has_temporal_sequence or has_individual_data:
                                 print(f"   Procesando template: {template.gesture_name}")
@@ -2,6 +2,7 @@
 Cliente de Supabase para guardar feedback de autenticación
 """
 import os
+import threading
 from supabase import create_client, Client
 from dotenv import load_dotenv
 import logging
@@ -15,8 +16,11 @@ logger = logging.getLogger(__name__)
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-# Cliente global (singleton)
+# Cliente global (singleton). Su cliente PostgREST mantiene una sesión httpx
+# con keep-alive: compartir una sola instancia reutiliza las conexiones TLS
+# entre todas las consultas del proceso
 _supabase_client: Client = None
+_supabase_client_lock = threading.Lock()
 
 
 def get_supabase_client() -> Client:
@@ -31,23 +35,29 @@ def get_supabase_client() -> Client:
     """
     global _supabase_client
     
-    if _supabase_client is None:
-        # Validar que existan las credenciales
-        if not SUPABASE_URL or not SUPABASE_KEY:
-            raise ValueError(
-                "ERROR: SUPABASE_URL y SUPABASE_KEY deben estar configurados en .env"
-            )
-        
-        # Crear cliente sin opciones adicionales
-        try:
-            _supabase_client = create_client(
-                supabase_url=SUPABASE_URL,
-                supabase_key=SUPABASE_KEY
-            )
-            logger.info("Cliente de Supabase inicializado correctamente")
-        except Exception as e:
-            logger.error(f"Error creando cliente: {e}")
-            raise
+    if _supabase_client is not None:
+        return _supabase_client
+    
+    # Doble comprobación: hilos de fondo (precarga, envíos) y peticiones
+    # concurrentes al arrancar no deben crear clientes (y pools) duplicados
+    with _supabase_client_lock:
+        if _supabase_client is None:
+            # Validar que existan las credenciales
+            if not SUPABASE_URL or not SUPABASE_KEY:
+                raise ValueError(
+                    "ERROR: SUPABASE_URL y SUPABASE_KEY deben estar configurados en .env"
+                )
+            
+            # Crear cliente sin opciones adicionales
+            try:
+                _supabase_client = create_client(
+                    supabase_url=SUPABASE_URL,
+                    supabase_key=SUPABASE_KEY
+                )
+                logger.info("Cliente de Supabase inicializado correctamente")
+            except Exception as e:
+                logger.error(f"Error creando cliente: {e}")
+                raise
     
     return _supabase_client
 
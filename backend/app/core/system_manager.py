@@ -1267,10 +1267,11 @@ class BiometricSystemManager:
             if template_type_str == 'TemplateType.ANATOMICAL':
                 print(f"      → Template ANATÓMICO")
                 
-                bootstrap_features = metadata.get('bootstrap_features', [])
-                print(f"      → bootstrap_features: {bool(bootstrap_features)}")
+                bootstrap_features = metadata.get('bootstrap_features')
+                has_bootstrap_features = bootstrap_features is not None and len(bootstrap_features) > 0
+                print(f"      → bootstrap_features: {has_bootstrap_features}")
                 
-                if not bootstrap_features:
+                if not has_bootstrap_features:
                     print(f"      ✗ NO hay bootstrap_features")
                     return False
                 
@@ -1310,10 +1311,11 @@ class BiometricSystemManager:
             elif template_type_str == 'TemplateType.DYNAMIC':
                 print(f"      → Template DINÁMICO")
                 
-                temporal_sequence = metadata.get('temporal_sequence', [])
-                print(f"      → temporal_sequence: {bool(temporal_sequence)}")
+                temporal_sequence = metadata.get('temporal_sequence')
+                has_temporal_sequence = temporal_sequence is not None and len(temporal_sequence) > 0
+                print(f"      → temporal_sequence: {has_temporal_sequence}")
                 
-                if not temporal_sequence:
+                if not has_temporal_sequence:
                     print(f"      ✗ NO hay temporal_sequence")
                     return False
                 
@@ -1457,9 +1459,9 @@ class BiometricSystemManager:
                 
                 # REGENERACIÓN DINÁMICA
                 elif template_type == 'dynamic':
-                    temporal_sequence = metadata.get('temporal_sequence', [])
+                    temporal_sequence = metadata.get('temporal_sequence')
                     
-                    if temporal_sequence and self.dynamic_network.is_trained:
+                    if temporal_sequence is not None and len(temporal_sequence) > 0 and self.dynamic_network.is_trained:
                         try:
                             sequence_array = np.array(temporal_sequence, dtype=np.float32)
                             
@@ -2,10 +2,14 @@
 Servicio para gestionar feedback de autenticacion y calcular metricas
 """
 import uuid
+import html
 import logging
 import os
 from datetime import datetime
-from typing import Dict, Any, Optional, List
+from functools import lru_cache
+from pathlib import Path
+from string import Formatter
+from typing import Dict, Any, Optional, List, Tuple
 from app.core.supabase_client import get_supabase_client
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail, Email, To, Content
@@ -16,6 +20,18 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+FEEDBACK_TEMPLATE_PATH = Path(__file__).parent / 'templates' / 'feedback_email.html'
+
+
+@lru_cache(maxsize=1)
+def _compile_feedback_template() -> Tuple[Tuple[str, Optional[str]], ...]:
+    """Lee la plantilla del email de feedback y la parte en (texto_fijo, placeholder) una sola vez"""
+    template = FEEDBACK_TEMPLATE_PATH.read_text(encoding='utf-8')
+    return tuple(
+        (literal, field_name)
+        for literal, field_name, _, _ in Formatter().parse(template)
+    )
+
 
 class AuthenticationFeedbackService:
     """
@@ -200,7 +216,8 @@ class AuthenticationFeedbackService:
         username: str,
         feedback_token: str,
         system_decision: str,
-        mode: str
+        mode: str,
+        background: bool = False
     ) -> bool:
         """
         Envia email de feedback con botones SI/NO.
@@ -212,9 +229,10 @@ class AuthenticationFeedbackService:
             feedback_token: Token unico para los botones
             system_decision: 'authenticated' o 'rejected'
             mode: 'verification' o 'identification'
+            background: Si es True, el envio se encola y no se espera
             
         Returns:
-            True si se envio correctamente
+            True si se envio correctamente (o se encolo, con background)
         """
         try:
             backend_url = os.getenv('BACKEND_URL', 'http://localhost:8000')
@@ -231,104 +249,33 @@ class AuthenticationFeedbackService:
             
             mode_text = 'verificacion biometrica' if mode == 'verification' else 'identificacion biometrica'
             
-            # Construir HTML
-            html_content = f"""
-    <!DOCTYPE html>
-    <html lang="es">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Confirmación de Acceso</title>
-    </head>
-    <body style="margin: 0; padding: 0; font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif; background: linear-gradient(135deg, #1e3a8a 0%, #0891b2 100%); min-height: 100vh;">
-        <table role="presentation" cellpadding="0" cellspacing="0" border="0" width="100%" style="background: linear-gradient(135deg, #1e3a8a 0%, #0891b2 100%); min-height: 100vh; padding: 40px 20px;">
-            <tr>
-                <td align="center">
-                    <table role="presentation" cellpadding="0" cellspacing="0" border="0" width="100%" style="max-width: 600px; background-color: #ffffff; border-radius: 16px; box-shadow: 0 20px 50px rgba(0, 0, 0, 0.3); overflow: hidden;">
-                        
-                        <!-- Header -->
-                        <tr>
-                            <td style="background: linear-gradient(135deg, #1e3a8a 0%, #0891b2 100%); padding: 40px 40px 30px 40px; text-align: center;">
-                                <h1 style="margin: 0; color: #ffffff; font-size: 32px; font-weight: 700; letter-spacing: -0.5px;">
-                                    Auth-Gesture
-                                </h1>
-                                <p style="margin: 8px 0 0 0; color: rgba(255, 255, 255, 0.9); font-size: 16px; font-weight: 400;">
-                                    Autenticación Biométrica por Gestos
-                                </p>
-                            </td>
-                        </tr>
-                        
-                        <!-- Contenido -->
-                        <tr>
-                            <td style="padding: 50px 40px;">
-                                <h2 style="margin: 0 0 16px 0; color: #1e293b; font-size: 24px; font-weight: 700;">
-                                    Hola {username}
-                                </h2>
-                                
-                                <p style="margin: 0 0 24px 0; color: #475569; font-size: 16px; line-height: 1.6;">
-                                    Se realizó una {mode_text} en tu cuenta.
-                                </p>
-                                
-                                <!-- Resultado -->
-                                <div style="background-color: #f8fafc; border-radius: 12px; padding: 24px; margin-bottom: 32px; text-align: center;">
-                                    <p style="margin: 0 0 8px 0; color: #64748b; font-size: 14px; font-weight: 500; text-transform: uppercase; letter-spacing: 0.5px;">
-                                        Resultado
-                                    </p>
-                                    <p style="margin: 0; color: #1e293b; font-size: 20px; font-weight: 700;">
-                                        {result_emoji}
-                                    </p>
-                                </div>
-                                
-                                <p style="margin: 0 0 32px 0; color: #475569; font-size: 16px; line-height: 1.6; text-align: center;">
-                                    ¿Fuiste tú quien intentó autenticarse?
-                                </p>
-                                
-                                <!-- Botones -->
-                                <table role="presentation" cellpadding="0" cellspacing="0" border="0" width="100%" style="margin-bottom: 32px;">
-                                    <tr>
-                                        <td align="center" style="padding-bottom: 12px;">
-                                            <a href="{confirm_url}" style="display: inline-block; width: 220px; background-color: #1e3a8a; background: linear-gradient(135deg, #1e3a8a 0%, #0891b2 100%); color: #ffffff; text-decoration: none; padding: 16px 24px; border-radius: 12px; font-weight: 600; font-size: 16px; letter-spacing: 0.3px; text-align: center; box-sizing: border-box;">
-                                                Sí, fui yo
-                                            </a>
-                                        </td>
-                                    </tr>
-                                    <tr>
-                                        <td align="center">
-                                            <a href="{deny_url}" style="display: inline-block; width: 220px; background-color: #f1f5f9; color: #475569; text-decoration: none; padding: 16px 24px; border-radius: 12px; font-weight: 600; font-size: 16px; letter-spacing: 0.3px; text-align: center; box-sizing: border-box;">
-                                                No, no fui yo
-                                            </a>
-                                        </td>
-                                    </tr>
-                                </table>
-                                
-                                <p style="margin: 0; color: #94a3b8; font-size: 14px; line-height: 1.6; text-align: center;">
-                                    Tu confirmación nos ayuda a mejorar la seguridad del sistema.
-                                </p>
-                            </td>
-                        </tr>
-                        
-                        <!-- Footer -->
-                        <tr>
-                            <td style="background-color: #f8fafc; padding: 32px 40px; border-top: 1px solid #e2e8f0;">
-                                <p style="margin: 0 0 8px 0; color: #64748b; font-size: 14px; text-align: center; font-weight: 500;">
-                                    Auth-Gesture
-                                </p>
-                                <p style="margin: 0; color: #94a3b8; font-size: 12px; text-align: center; line-height: 1.5;">
-                                    Este es un email automático. Por favor no respondas.
-                                </p>
-                            </td>
-                        </tr>
-                        
-                    </table>
-                </td>
-            </tr>
-        </table>
-    </body>
-    </html>
-            """
+            # Construir HTML desde la plantilla precompilada
+            values = {
+                'username': html.escape(username),
+                'result_emoji': result_emoji,
+                'mode_text': mode_text,
+                'confirm_url': confirm_url,
+                'deny_url': deny_url
+            }
+            html_content = ''.join([
+                literal + values[field_name] if field_name is not None else literal
+                for literal, field_name in _compile_feedback_template()
+            ])
             
             # USAR EL NUEVO SERVICIO CON FALLBACK
             email_service = get_email_service()
+            
+            if background:
+                future = email_service.send_email_async(
+                    to_email=user_email,
+                    subject='Confirmacion de acceso - Auth-Gesture',
+                    html_content=html_content
+                )
+                future.add_done_callback(
+                    lambda done: self._log_feedback_email_result(user_email, done.result())
+                )
+                return True
+            
             result = email_service.send_email(
                 to_email=user_email,
                 subject='Confirmacion de acceso - Auth-Gesture',
@@ -348,6 +295,13 @@ class AuthenticationFeedbackService:
             traceback.print_exc()
             return False
     
+    def _log_feedback_email_result(self, user_email: str, result: dict):
+        """Registra el resultado de un envio de feedback en segundo plano"""
+        if result['success']:
+            logger.info(f"Email de feedback enviado a {user_email} via {result['provider']}")
+        else:
+            logger.error(f"Error enviando email de feedback a {user_email}: {result.get('error')}")
+    
     def save_authentication_attempt(
         self,
         session_id: str,
@@ -417,15 +371,17 @@ class AuthenticationFeedbackService:
             # ENVIAR EMAIL DE FEEDBACK AUTOMATICAMENTE
             try:
                 if user_email:
-                    email_sent = self.send_feedback_email(
+                    # En segundo plano: la autenticacion no espera al proveedor
+                    email_queued = self.send_feedback_email(
                         user_email=user_email,
                         username=username,
                         feedback_token=feedback_token,
                         system_decision=system_decision,
-                        mode=mode
+                        mode=mode,
+                        background=True
                     )
-                    if email_sent:
-                        logger.info(f"Email de feedback enviado a {user_email}")
+                    if email_queued:
+                        logger.info(f"Email de feedback encolado para {user_email}")
                     else:
                         logger.warning(f"No se pudo enviar email a {user_email}")
                 else:
@@ -5,6 +5,7 @@ SendGrid (primario) -> Resend (respaldo)
 
 import os
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Optional
 from dotenv import load_dotenv
 
@@ -12,6 +13,35 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Cliente HTTP con pool de conexiones (dependencia de supabase)
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+    logger.warning("httpx no disponible - Resend usará su SDK sin keep-alive")
+
+# Serialización JSON rápida de los payloads (opcional)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    import json
+    ORJSON_AVAILABLE = False
+
+RESEND_API_HOST = 'https://api.resend.com'
+
+
+def _dump_json(payload: dict) -> bytes:
+    """Serializa el payload a JSON (bytes), con orjson si está disponible"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+# Pool compartido para enviar emails en segundo plano: el POST HTTPS al
+# proveedor (y el posible fallback) no bloquea al llamador
+_send_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="email-send")
+
 
 class EmailService:
     """
@@ -24,10 +54,25 @@ class EmailService:
         self.sendgrid_api_key = os.getenv('SENDGRID_API_KEY')
         self.sendgrid_from_email = os.getenv('SENDGRID_FROM_EMAIL', 'noreply@authgesture.com')
         self.sendgrid_from_name = os.getenv('SENDGRID_FROM_NAME', 'Auth-Gesture Sistema Biométrico')
+        self._sendgrid_client = None
         
         # Resend
         self.resend_api_key = os.getenv('RESEND_API_KEY')
         
+        # Conexión persistente (keep-alive) con la API de Resend: evita el
+        # handshake TCP+TLS en cada envío de respaldo
+        self._resend_http = None
+        if self.resend_api_key and HTTPX_AVAILABLE:
+            self._resend_http = httpx.Client(
+                base_url=RESEND_API_HOST,
+                headers={
+                    'Authorization': f'Bearer {self.resend_api_key}',
+                    'Content-Type': 'application/json'
+                },
+                timeout=10.0,
+                limits=httpx.Limits(max_connections=16, max_keepalive_connections=4)
+            )
+        
         # Verificar configuración
         if self.sendgrid_api_key:
             logger.info("✓ SendGrid configurado (primario)")
@@ -87,6 +132,31 @@ class EmailService:
             'error': 'No hay proveedores de email configurados'
         }
     
+    def send_email_async(
+        self,
+        to_email: str,
+        subject: str,
+        html_content: str,
+        from_email: Optional[str] = None,
+        from_name: Optional[str] = None
+    ) -> Future:
+        """
+        Envía un email en segundo plano (mismo flujo SendGrid -> Resend).
+        
+        Args:
+            to_email: Email destino
+            subject: Asunto del email
+            html_content: Contenido HTML
+            from_email: Email remitente (opcional)
+            from_name: Nombre remitente (opcional)
+            
+        Returns:
+            Future que resuelve al dict de send_email
+        """
+        return _send_executor.submit(
+            self.send_email, to_email, subject, html_content, from_email, from_name
+        )
+    
     def _send_with_sendgrid(
         self,
         to_email: str,
@@ -97,7 +167,6 @@ class EmailService:
     ) -> dict:
         """Envía email usando SendGrid."""
         try:
-            from sendgrid import SendGridAPIClient
             from sendgrid.helpers.mail import Mail, Email, To, Content
             
             message = Mail(
@@ -107,8 +176,7 @@ class EmailService:
                 html_content=Content("text/html", html_content)
             )
             
-            sg_client = SendGridAPIClient(self.sendgrid_api_key)
-            response = sg_client.send(message)
+            response = self._get_sendgrid_client().send(message)
             
             if response.status_code in [200, 201, 202]:
                 logger.info(f"✓ Email enviado con SendGrid a {to_email}")
@@ -132,6 +200,14 @@ class EmailService:
                 'error': str(e)
             }
     
+    def _get_sendgrid_client(self):
+        """Cliente SendGrid compartido por todos los envíos (se crea al primer uso)"""
+        if self._sendgrid_client is None:
+            from sendgrid import SendGridAPIClient
+            
+            self._sendgrid_client = SendGridAPIClient(self.sendgrid_api_key)
+        return self._sendgrid_client
+    
     def _send_with_resend(
         self,
         to_email: str,
@@ -142,10 +218,6 @@ class EmailService:
     ) -> dict:
         """Envía email usando Resend."""
         try:
-            import resend
-            
-            resend.api_key = self.resend_api_key
-            
             params = {
                 "from": f"{from_name} <{from_email}>",
                 "to": [to_email],
@@ -153,7 +225,16 @@ class EmailService:
                 "html": html_content
             }
             
-            email = resend.Emails.send(params)
+            if self._resend_http is not None:
+                # Mismo payload y respuesta ({"id": ...}) que resend.Emails.send
+                response = self._resend_http.post('/emails', content=_dump_json(params))
+                response.raise_for_status()
+                email = orjson.loads(response.content) if ORJSON_AVAILABLE else response.json()
+            else:
+                import resend
+                
+                resend.api_key = self.resend_api_key
+                email = resend.Emails.send(params)
             
             logger.info(f"✓ Email enviado con Resend a {to_email} (ID: {email.get('id')})")
             return {
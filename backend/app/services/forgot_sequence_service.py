@@ -4,6 +4,7 @@ Maneja envío de OTP, verificación y preparación para re-registro
 """
 
 import logging
+import time
 from datetime import datetime
 from typing import Optional, Dict, Any
 
@@ -118,18 +119,14 @@ class ForgotSequenceService:
             
             # Expirado (igual que verify-code)
             # Expirado (igual que verify-code)
-            expires_at = datetime.fromisoformat(verification.expires_at)
-            # Remover timezone si existe para comparación
-            if expires_at.tzinfo is not None:
-                expires_at = expires_at.replace(tzinfo=None)
-            if datetime.now() > expires_at:
+            if time.time() > verification.expires_at_ts:
                 return {
                     'success': False,
                     'message': 'Código expirado. Solicita uno nuevo.'
                 }
             
             # Verificar código (igual que verify-code)
-            if verification.token != otp_code:
+            if not self.email_service.token_matches(verification, otp_code):
                 return {
                     'success': False,
                     'message': 'Código incorrecto.'
@@ -138,7 +135,14 @@ class ForgotSequenceService:
             # Marcar como verificado (igual que verify-code)
             verification.verified = True
             verification.verification_date = datetime.now().isoformat()
-            self.email_service._save_verification(verification)
+            
+            # Compare-and-set: un segundo uso concurrente del mismo código no
+            # autoriza otro re-enrollment
+            if not self.email_service._save_verification(verification):
+                return {
+                    'success': False,
+                    'message': 'Este código ya fue utilizado.'
+                }
             
             logger.info(f"Código verificado: {verification.email}")
             
@@ -178,16 +182,12 @@ class ForgotSequenceService:
             verification = self.email_service._load_verification(user.user_id)
             
             if verification:
-                # Verificar cooldown (60 segundos - igual que el existente)
-                created_at = datetime.fromisoformat(verification.created_at)
-                # Remover timezone si existe
-                if created_at.tzinfo is not None:
-                    created_at = created_at.replace(tzinfo=None)
-                    
-                elapsed = (datetime.now() - created_at).total_seconds()
+                # Verificar cooldown (mismo valor que el sistema de verificación)
+                elapsed = time.time() - verification.created_at_ts
                 
-                if elapsed < 60:
-                    remaining = int(60 - elapsed)
+                cooldown = self.email_service.resend_cooldown_seconds
+                if elapsed < cooldown:
+                    remaining = int(cooldown - elapsed)
                     return {
                         'success': False,
                         'message': f'Espera {remaining} segundos antes de reenviar'
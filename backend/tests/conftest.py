@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Permite importar el paquete `app` al lanzar pytest desde backend/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,212 @@
+"""
+Pruebas de persistencia de BiometricDatabase (modo Bootstrap).
+"""
+
+import gc
+import json
+import weakref
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from app.core.biometric_database import (
+    AuthenticationAttempt, BiometricDatabase, BiometricTemplate, TemplateType, NPY_SENTINEL
+)
+
+
+FEATURE_DIM = 320
+TEMPLATES_PER_USER = 5
+
+
+def _enroll_users(db: BiometricDatabase, user_ids):
+    """Inscribe templates Bootstrap con secuencia temporal real para cada usuario."""
+    rng = np.random.default_rng(0)
+    for n, user_id in enumerate(user_ids):
+        for i in range(TEMPLATES_PER_USER):
+            template_id = db.enroll_template_bootstrap(
+                user_id=user_id,
+                anatomical_features=rng.random(180, dtype=np.float32),
+                gesture_name=f"gesture_{i}",
+                sample_metadata={
+                    'username': user_id,
+                    'email': f'{user_id}@example.com',
+                    'phone_number': f'60000000{n}',
+                    'age': 30,
+                    'gender': 'other',
+                    'has_temporal_data': True,
+                    'temporal_sequence': rng.random((10, FEATURE_DIM), dtype=np.float32),
+                }
+            )
+            assert template_id is not None
+
+
+def test_bootstrap_sequences_reload_from_npy_sidecars(tmp_path):
+    _enroll_users(BiometricDatabase(str(tmp_path)), ['user_a', 'user_b'])
+    
+    reloaded = BiometricDatabase(str(tmp_path))
+    sequences = [
+        template.metadata['temporal_sequence']
+        for template in reloaded.templates.values()
+        if 'temporal_sequence' in template.metadata
+    ]
+    
+    assert len(sequences) >= 2 * TEMPLATES_PER_USER
+    for sequence in sequences:
+        assert not (isinstance(sequence, dict) and NPY_SENTINEL in sequence)
+        assert np.asarray(sequence).shape == (10, FEATURE_DIM)
+        # Cargado en memoria (sin mmap): editable por los consumidores
+        assert not isinstance(sequence, np.memmap)
+        assert sequence.flags.writeable
+
+
+def test_reloaded_bootstrap_templates_feed_dynamic_training(tmp_path):
+    pytest.importorskip("sklearn")
+    from app.core.siamese_dynamic_network import SiameseDynamicNetwork
+    
+    _enroll_users(BiometricDatabase(str(tmp_path)), ['user_a', 'user_b'])
+    reloaded = BiometricDatabase(str(tmp_path))
+    
+    # Solo se ejercita la carga de datos: no hace falta construir el modelo
+    network = SimpleNamespace(
+        config={},
+        feature_dim=FEATURE_DIM,
+        real_training_samples=[],
+        real_validation_samples=[],
+    )
+    
+    assert SiameseDynamicNetwork.load_real_temporal_data_from_database(network, reloaded)
+    
+    loaded = network.real_training_samples + network.real_validation_samples
+    assert {sample.user_id for sample in loaded} == {'user_a', 'user_b'}
+    assert len(loaded) >= 2 * TEMPLATES_PER_USER
+
+
+def test_in_place_template_update_keeps_counters_consistent(tmp_path):
+    db = BiometricDatabase(str(tmp_path))
+    assert db.create_user('user_a', 'user_a', 'user_a@example.com', '600000000', 30, 'Femenino')
+    
+    template = BiometricTemplate(
+        user_id='user_a',
+        template_id='user_a_template',
+        template_type=TemplateType.ANATOMICAL,
+        anatomical_embedding=np.ones(64, dtype=np.float32),
+    )
+    assert db.store_biometric_template(template)
+    
+    # Patrón habitual de actualización: se modifica el mismo objeto y se vuelve a guardar
+    template.template_type = TemplateType.DYNAMIC
+    template.dynamic_embedding = np.ones(128, dtype=np.float32)
+    assert db.store_biometric_template(template)
+    
+    assert db.stats.total_templates == 1
+    assert db.stats.anatomical_templates == 0
+    assert db.stats.dynamic_templates == 1
+    assert db.stats.multimodal_templates == 0
+    assert db.stats.anatomical_embeddings == 1
+    assert db.stats.dynamic_embeddings == 1
+
+
+
+def test_close_flushes_queued_auth_attempts(tmp_path):
+    db = BiometricDatabase(str(tmp_path))
+    for i in range(10):
+        assert db.store_authentication_attempt(AuthenticationAttempt(
+            attempt_id=f'attempt_{i}',
+            user_id='user_a',
+            timestamp=float(i),
+            auth_type='verification',
+            result='success',
+            confidence=1.0,
+            anatomical_score=1.0,
+            dynamic_score=1.0,
+            fused_score=1.0,
+        ))
+    
+    db.close()
+    
+    assert not db._writer_thread.is_alive()
+    attempts = json.loads((tmp_path / 'auth_attempts' / 'user_a.json').read_text())
+    assert [a['attempt_id'] for a in attempts] == [f'attempt_{i}' for i in range(10)]
+
+
+def test_closed_database_is_not_retained_by_atexit(tmp_path):
+    db = BiometricDatabase(str(tmp_path))
+    db.close()
+    ref = weakref.ref(db)
+    
+    del db
+    gc.collect()
+    
+    assert ref() is None
+
+
+def test_failed_bootstrap_write_rolls_back_memory_state(tmp_path, monkeypatch):
+    db = BiometricDatabase(str(tmp_path))
+    _enroll_users(db, ['user_a'])
+    
+    templates_before = set(db.templates)
+    profile = db.users['user_a']
+    enrollments_before = profile.total_enrollments
+    anatomical_ids_before = list(profile.anatomical_templates)
+    stats_before = (db.stats.total_templates, db.stats.anatomical_templates, db.stats.dynamic_templates)
+    
+    def failing_write(writes):
+        raise OSError("disco lleno")
+    monkeypatch.setattr(db, '_write_files', failing_write)
+    
+    assert db.enroll_template_bootstrap(
+        user_id='user_a',
+        anatomical_features=np.ones(180, dtype=np.float32),
+        gesture_name='new_gesture',
+        sample_metadata={'has_temporal_data': True,
+                         'temporal_sequence': np.ones((10, FEATURE_DIM), dtype=np.float32)}
+    ) is None
+    
+    assert set(db.templates) == templates_before
+    assert profile.total_enrollments == enrollments_before
+    assert profile.anatomical_templates == anatomical_ids_before
+    assert 'new_gesture' not in profile.gesture_sequence
+    assert (db.stats.total_templates, db.stats.anatomical_templates, db.stats.dynamic_templates) == stats_before
+    assert not any(tid not in templates_before for tid in (p.stem for p in (tmp_path / 'templates').glob('*.json')))
+
+
+def test_failed_backup_removes_partial_archive(tmp_path, monkeypatch):
+    db = BiometricDatabase(str(tmp_path))
+    _enroll_users(db, ['user_a'])
+    
+    import tarfile
+    
+    def failing_add(self, *args, **kwargs):
+        raise OSError("disco lleno")
+    
+    monkeypatch.setattr(tarfile.TarFile, 'add', failing_add)
+    
+    assert db.create_backup() is False
+    assert list((tmp_path / 'backups').iterdir()) == []
+
+
+def test_enroll_without_temporal_data_uses_anatomical_fallback(tmp_path):
+    db = BiometricDatabase(str(tmp_path))
+    rng = np.random.default_rng(0)
+    for i in range(TEMPLATES_PER_USER):
+        assert db.enroll_template_bootstrap(
+            user_id='user_a',
+            anatomical_features=rng.random(180, dtype=np.float32),
+            gesture_name=f"gesture_{i}",
+            sample_metadata={
+                'username': 'user_a',
+                'email': 'user_a@example.com',
+                'phone_number': '600000000',
+                'age': 30,
+                'gender': 'Femenino',
+            }
+        ) is not None
+    
+    sources = [
+        template.metadata.get('data_source')
+        for template in db.templates.values()
+        if template.template_type == TemplateType.DYNAMIC
+    ]
+    assert sources == ['anatomical_templates_fallback']